@@ -1,70 +1,267 @@
 import os
+import re
 import json
 import uuid
 import aiohttp
 import asyncio
-import requests
 import base64
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
-import whisper
-import numpy as np
-import soundfile as sf
-import io
-import subprocess
-import tempfile
-import PyPDF2
-import docx
-import openpyxl
-import re
-from pathlib import Path
+from quart import Quart, Response, g, request, jsonify, websocket
+from quart_cors import cors
+from collections import Counter
 from threading import Lock
-import asyncio
-import aiohttp
-from sentence_transformers import SentenceTransformer, util
-import numpy as np
+import conversation_store
+import context_builder
+import retrieval_context
+import image_store
+import titles
+import metrics
+from audio import SpeechSegmenter, decode_audio, pcm16_to_float32
+from stt_worker import STTQueueFull, STTWorker, load_stt_backend
+from llm_scheduler import BACKGROUND, INTERACTIVE, REGENERATION, LLMQueueFull, LLMScheduler, backoff_delay
+from resources import LazyResource
+from vector_index import VectorIndex
+from bm25_index import BM25_FILE, BM25Index, reciprocal_rank_fusion
+from process_lock import try_lock
+from caching import SemanticCache, TTLCache
+from query_router import QueryRouter, ROUTE_CHAT, ROUTE_SEARCH
+import extractors
+from embeddings import encode_corpus, load_embedding_model
+from chunking import StructuredChunker
+from file_manifest import load_manifest, save_manifest, scan_folder, start_watcher
 
 OLLAMA_TIMEOUT = 60  # Increased timeout to 60 seconds
 
 # ========== CONFIG ==========
-OLLAMA_URL = "http://localhost:11434/api/chat"
+OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434/api/chat")
+OLLAMA_TAGS_URL = OLLAMA_URL.rsplit("/api/", 1)[0] + "/api/tags"
+OLLAMA_MAX_CONNECTIONS = 32  # keep-alive pool shared by every request
+# Calls in flight at once per model (match OLLAMA_NUM_PARALLEL); the rest queue by priority, see llm_scheduler.py
+OLLAMA_MODEL_CONCURRENCY = {"mistral": 6, "llava": 2}
+OLLAMA_DEFAULT_CONCURRENCY = 2
+OLLAMA_MAX_QUEUE = 32  # calls waiting per model beyond this get a 429
 MODEL_NAME = "mistral"
-CONVERSATION_FILE = "conversations.json"
-
-# Load Whisper model (small is fast, runs locally)
-whisper_model = whisper.load_model("small")
+# tokenizer.json of the chat model (copy it from the model's Hugging Face repo), or a hub id to download it
+CONTEXT_TOKENIZER = os.environ.get("CONTEXT_TOKENIZER", "tokenizer.json")
+CONTEXT_WINDOW = 4096  # num_ctx requested from Ollama
+CONTEXT_REPLY_TOKENS = 1024  # kept free for the reply; the prompt gets the rest
+CONTEXT_HISTORY_MESSAGES = 40  # most recent messages considered for verbatim history
+SUMMARY_KEEP_RECENT = 8  # newest messages never folded into the rolling summary
+SUMMARY_BATCH = 4  # fold aged-out messages once this many have accumulated
+SUMMARY_MAX_STEP = 20  # messages folded per summarization call
+SUMMARY_INPUT_TOKENS = 2048
+TITLE_KEYWORDS = True  # title from key phrases of the first question when they fit; the LLM otherwise
+CONVERSATION_FILE = "conversations.json"  # legacy store, migrated into CONVERSATION_DB
+CONVERSATION_DB = "conversations.db"
+INDEX_DIR = "index"  # persisted chunk embeddings and BM25 postings, see vector_index.py / bm25_index.py
+INDEXER_LOCK_FILE = "indexer.lock"  # held by the one worker process that extracts and embeds documents
+INDEX_FOLLOW_INTERVAL = 5  # seconds between other workers' checks for a newly published index
+CONVERSATION_PAGE_SIZE = 50  # sidebar rows per GET /api/conversations page
+MESSAGE_PAGE_SIZE = 50  # messages per GET /api/conversations/<id>/messages page
+MAX_PAGE_SIZE = 200
+IMAGE_DIR = "images"  # uploaded images, content-addressed, see image_store.py
+IMAGE_CACHE_MAX_AGE = 31536000  # ids are content hashes, so a URL never changes content
+# "background": warm the models once the server is listening; "lazy": load each on first use;
+# "eager": load them while importing this module (the old behaviour, see bench_startup.py)
+MODEL_LOADING = os.environ.get("MODEL_LOADING", "background")
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_DIMENSION = 384  # of EMBEDDING_MODEL_NAME; the vector index is loaded before the model
+EMBED_BACKEND = "torch"  # "torch", "onnx" or "onnx-int8" (quantized MiniLM)
+EMBED_BATCH_SIZE = 64
+EMBED_THREADS = os.cpu_count() or 1
+EMBED_STORAGE_DTYPE = "float32"  # "float32", "float16" or "int8" storage of chunk vectors
+
+STT_BACKEND = "openai-whisper"  # or "faster-whisper" (CTranslate2, int8 on CPU)
+STT_MODEL_SIZE = "small"  # small is fast, runs locally
+STT_QUEUE_SIZE = 16  # clips waiting beyond this get a 429
+STT_MAX_BATCH = 8
+TRACE_LOG_SECONDS = float(os.environ.get("TRACE_LOG_SECONDS", "5"))  # slower requests log their stage trace
+
+# One worker thread owns the speech model (loaded there on first use); requests queue clips for it
+stt_backend = LazyResource("speech-to-text", lambda: load_stt_backend(STT_BACKEND, STT_MODEL_SIZE))
+stt_worker = STTWorker(stt_backend, STT_QUEUE_SIZE, STT_MAX_BATCH).start()
+import itertools
 import threading
 import time
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+
+
+# ========== METRICS ==========
+# Served at GET /metrics; stage latencies go to metrics.STAGE_SECONDS through metrics.span()
+HTTP_REQUEST_SECONDS = metrics.Histogram(
+    "lpee_http_request_seconds", "Time until the response headers are sent.", ["endpoint", "method", "status"])
+FIRST_TOKEN_SECONDS = metrics.Histogram(
+    "lpee_first_token_seconds", "Time from a streamed chat request to its first reply token.")
+LLM_RETRIES = metrics.Counter("lpee_llm_retries_total", "LLM calls attempted again after a failure.", ["call"])
+LLM_TIMEOUTS = metrics.Counter("lpee_llm_timeouts_total", "LLM call attempts that timed out.", ["call"])
+LLM_FAILURES = metrics.Counter("lpee_llm_failures_total", "LLM calls that failed after all attempts.", ["call"])
+MCP_PARSE_FAILURES = metrics.Counter("lpee_mcp_parse_failures_total", "MCP replies that were not valid JSON.")
+CHAT_ROUTES = metrics.Counter("lpee_chat_routes_total", "How chat questions were answered.", ["route"])
+
+
+def log_trace(trace):
+    if trace.elapsed() >= TRACE_LOG_SECONDS:
+        print(f"[Trace] {trace.to_json()}")
+
+
+# ========== OLLAMA CLIENT ==========
+# One pooled keep-alive session for the whole process, opened when the server starts
+http_session = None
+llm_scheduler = LLMScheduler(OLLAMA_MODEL_CONCURRENCY, OLLAMA_DEFAULT_CONCURRENCY, OLLAMA_MAX_QUEUE)
+
+
+async def open_http_session():
+    global http_session
+    connector = aiohttp.TCPConnector(limit=OLLAMA_MAX_CONNECTIONS, keepalive_timeout=60)
+    http_session = aiohttp.ClientSession(connector=connector)
+
+
+async def close_http_session():
+    if http_session is not None:
+        await http_session.close()
+
+
+async def ollama_chat(payload, timeout=OLLAMA_TIMEOUT, priority=INTERACTIVE):
+    """POST a non-streaming chat request to Ollama and return the decoded JSON body.
+
+    Waits for a slot for the model at ``priority``. Raises ``LLMQueueFull`` when
+    too many calls are already waiting and ``aiohttp.ClientResponseError`` for
+    non-2xx responses.
+    """
+    model = payload["model"]
+    with metrics.span("llm_wait"):
+        await llm_scheduler.acquire(model, priority)
+    try:
+        async with http_session.post(OLLAMA_URL, json={**payload, "stream": False},
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            return await response.json()
+    finally:
+        llm_scheduler.release(model)
+
+
+LLM_ERROR_REPLY = "❌ Error from LLM backend."
+BACKEND_UNAVAILABLE_REPLY = "⚠️ Unable to reach backend after retries. Please try again."
+LLM_BUSY_REPLY = "⚠️ The assistant is busy right now. Please try again in a moment."
+LLM_BUSY_RETRY_AFTER = 5  # seconds, sent as Retry-After with a 429
 
 
+def llm_busy_response():
+    return jsonify({"error": LLM_BUSY_REPLY}), 429, {"Retry-After": str(LLM_BUSY_RETRY_AFTER)}
 
-async def fetch_ai_reply(session, messages, retries=3):
+
+def is_retryable_status(status):
+    # Client errors (unknown model, bad payload) fail the same way every time
+    return status >= 500 or status == 429
+
+
+async def fetch_ai_reply(messages, model=MODEL_NAME, retries=3, priority=INTERACTIVE):
+    """Reply text from Ollama, retrying failures with jittered backoff.
+
+    ``LLMQueueFull`` is not retried: it propagates so the route can answer 429.
+    """
     for attempt in range(retries):
+        if attempt:
+            LLM_RETRIES.inc(call="reply")
+            await asyncio.sleep(backoff_delay(attempt - 1))
         try:
-            print(f"[DEBUG] Attempting AI reply call {attempt + 1}/{retries}")
-            async with session.post(OLLAMA_URL, json={
-                "model": MODEL_NAME,
-                "messages": messages,
-                "stream": False
-            }, timeout=OLLAMA_TIMEOUT) as response:
-                if response.ok:
-                    data = await response.json()
-                    content = data.get("message", {}).get("content", "❌ Error from LLM backend.")
-                    print(f"[DEBUG] AI reply received: {content[:100]}...")
-                    return content
-                else:
-                    print(f"[ERROR] LLM backend returned status {response.status} on attempt {attempt+1}")
-                    await asyncio.sleep(1)
+            data = await ollama_chat({"model": model, "messages": messages, "options": {"num_ctx": CONTEXT_WINDOW}},
+                                     priority=priority)
+            return data.get("message", {}).get("content", LLM_ERROR_REPLY)
+        except LLMQueueFull:
+            raise
+        except aiohttp.ClientResponseError as e:
+            print(f"[ERROR] LLM backend returned status {e.status} on attempt {attempt+1}")
+            if not is_retryable_status(e.status):
+                break
         except asyncio.TimeoutError:
+            LLM_TIMEOUTS.inc(call="reply")
             print(f"[ERROR] LLM backend call timed out on attempt {attempt+1}")
-            await asyncio.sleep(2)
         except Exception as e:
             print(f"[ERROR] LLM backend call error on attempt {attempt+1}: {e}")
-            await asyncio.sleep(1)
-    return "⚠️ Unable to reach backend after retries. Please try again."
+    LLM_FAILURES.inc(call="reply")
+    return BACKEND_UNAVAILABLE_REPLY
 
 
-async def fetch_real_mcp_reply(session, user_question, max_retries=5):
+async def stream_ai_reply(messages, model=MODEL_NAME):
+    """Yield reply tokens from Ollama as they are generated (``"stream": True``)."""
+    # No total timeout: only the gap between chunks is bounded
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=OLLAMA_TIMEOUT)
+    with metrics.span("llm_wait"):
+        await llm_scheduler.acquire(model, INTERACTIVE)
+    try:
+        async with http_session.post(OLLAMA_URL, json={
+            "model": model,
+            "messages": messages,
+            "stream": True,
+            "options": {"num_ctx": CONTEXT_WINDOW}
+        }, timeout=timeout) as response:
+            response.raise_for_status()
+            # Ollama streams one JSON object per line
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                token = chunk.get("message", {}).get("content", "")
+                if token:
+                    yield token
+                if chunk.get("done"):
+                    break
+    finally:
+        llm_scheduler.release(model)
+
+# JSON schema passed as Ollama's "format" so the MCP reply is constrained to valid JSON
+MCP_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "search_needed": {"type": "boolean"},
+        "search_query": {"type": ["string", "null"]},
+        "assistant_reply": {"type": ["string", "null"]}
+    },
+    "required": ["search_needed", "search_query", "assistant_reply"]
+}
+
+mcp_stats = Counter()
+mcp_stats_lock = Lock()
+
+
+def extract_json_object(text):
+    """Return the first JSON object in ``text``, tolerating code fences and surrounding prose."""
+    decoder = json.JSONDecoder()
+    start = text.find("{")
+    while start != -1:
+        try:
+            obj, _ = decoder.raw_decode(text, start)
+            if isinstance(obj, dict):
+                return obj
+        except json.JSONDecodeError:
+            pass
+        start = text.find("{", start + 1)
+    return None
+
+
+def is_valid_mcp_reply(parsed):
+    return (
+        isinstance(parsed, dict) and
+        isinstance(parsed.get("search_needed"), bool) and
+        isinstance(parsed.get("search_query"), (str, type(None))) and
+        isinstance(parsed.get("assistant_reply"), (str, type(None)))
+    )
+
+
+def record_mcp_stats(attempts, parse_failures, timeouts, latency, ok):
+    with mcp_stats_lock:
+        mcp_stats["requests"] += 1
+        mcp_stats["attempts"] += attempts
+        mcp_stats["retries"] += attempts - 1
+        mcp_stats["parse_failures"] += parse_failures
+        mcp_stats["timeouts"] += timeouts
+        mcp_stats["failures"] += 0 if ok else 1
+        mcp_stats["latency_ms_total"] += int(latency * 1000)
+
+
+async def fetch_real_mcp_reply(user_question, max_retries=3):
     mcp_prompt = [
         {"role": "system", "content": """You are a strict MCP assistant. Reply ONLY with JSON with keys: search_needed (bool), search_query (string|null), assistant_reply (string|null). No text outside JSON.
 
@@ -81,58 +278,48 @@ Examples:
         {"role": "user", "content": user_question}
     ]
 
+    started = time.perf_counter()
+    parse_failures = 0
+    timeouts = 0
     for attempt in range(max_retries):
+        if attempt:
+            LLM_RETRIES.inc(call="mcp")
+            await asyncio.sleep(backoff_delay(attempt - 1))
         try:
-            print(f"[DEBUG] Attempting MCP call {attempt + 1}/{max_retries}")
-            async with session.post(OLLAMA_URL, json={"model": MODEL_NAME, "messages": mcp_prompt, "stream": False}, timeout=OLLAMA_TIMEOUT) as resp:
-                if not resp.ok:
-                    print(f"[ERROR] Ollama returned status {resp.status} on attempt {attempt + 1}")
-                    await asyncio.sleep(1)  # Wait before retry
-                    continue
-                
-                data = await resp.json()
-                content = data.get("message", {}).get("content", "")
-                print(f"[DEBUG] Received content: {content[:100]}...")
-                
-                try:
-                    parsed = json.loads(content)
-                    # Validate all fields strictly
-                    if (
-                        isinstance(parsed, dict) and
-                        isinstance(parsed.get("search_needed"), bool) and
-                        (isinstance(parsed.get("search_query"), (str, type(None)))) and
-                        (isinstance(parsed.get("assistant_reply"), (str, type(None))))
-                    ):
-                        print(f"[DEBUG] Valid MCP response received")
-                        return parsed
-                    else:
-                        print(f"[DEBUG] Invalid MCP response structure, retrying...")
-                        # Prepare a strict correction prompt to send to model
-                        correction_msg = {
-                            "role": "system",
-                            "content": "Your last reply was not a valid MCP JSON. Reply ONLY with valid JSON with correct keys and types."
-                        }
-                        mcp_prompt.append({"role": "assistant", "content": content})
-                        mcp_prompt.append(correction_msg)
-                except json.JSONDecodeError as e:
-                    print(f"[DEBUG] JSON decode error: {e}, retrying...")
-                    # Same as above: send correction prompt
-                    correction_msg = {
-                        "role": "system",
-                        "content": "Your last reply was invalid JSON. Reply ONLY with valid MCP JSON."
-                    }
-                    mcp_prompt.append({"role": "assistant", "content": content})
-                    mcp_prompt.append(correction_msg)
-                    
+            data = await ollama_chat({
+                "model": MODEL_NAME,
+                "messages": mcp_prompt,
+                "format": MCP_SCHEMA,
+                "options": {"temperature": 0}
+            })
+            content = data.get("message", {}).get("content", "")
+            parsed = extract_json_object(content)
+            if is_valid_mcp_reply(parsed):
+                latency = time.perf_counter() - started
+                record_mcp_stats(attempt + 1, parse_failures, timeouts, latency, True)
+                return parsed
+
+            # The schema makes this rare; retry the same prompt rather than growing it
+            parse_failures += 1
+            MCP_PARSE_FAILURES.inc()
+
+        except LLMQueueFull:
+            raise
+        except aiohttp.ClientResponseError as e:
+            print(f"[ERROR] Ollama returned status {e.status} on attempt {attempt + 1}")
+            if not is_retryable_status(e.status):
+                break
         except asyncio.TimeoutError:
+            timeouts += 1
+            LLM_TIMEOUTS.inc(call="mcp")
             print(f"[ERROR] Ollama request timed out on attempt {attempt + 1}")
-            await asyncio.sleep(2)  # Wait longer after timeout
         except Exception as e:
             print(f"[ERROR] Unexpected error on attempt {attempt + 1}: {e}")
-            await asyncio.sleep(1)
 
     # After max retries, fail gracefully
-    print(f"[ERROR] MCP protocol failed after {max_retries} retries")
+    record_mcp_stats(attempt + 1, parse_failures, timeouts, time.perf_counter() - started, False)
+    LLM_FAILURES.inc(call="mcp")
+    print(f"[ERROR] MCP protocol failed after {attempt + 1} attempts")
     return {
         "search_needed": False,
         "search_query": None,
@@ -143,305 +330,875 @@ Examples:
 
 
 
-def background_file_cache_refresher(interval_seconds=3600):
-    global file_cache
+def refresh_file_cache(reindex=False):
+    """Re-extract and re-embed only the files added, changed or deleted since the last run.
+
+    ``reindex`` extracts every file again (chunks that did not change are still
+    not re-embedded). Files stream through extraction, chunking and embedding
+    and are merged into the indexes every INDEX_UPDATE_CHUNKS chunks, so no
+    document text is kept once its chunks are indexed. The manifest is only
+    updated once the indexes holding those files are saved, so a failed refresh
+    is retried. Files it lists that the vector index lacks (a lost or rebuilt
+    index, e.g. after a model change) are extracted again.
+    """
+    global file_manifest, saved_index_versions
+    with index_refresh_lock:
+        changed, removed, new_manifest = scan_folder(FILE_FOLDER, file_manifest, SUPPORTED_EXTENSIONS)
+        if reindex:
+            changed = list(new_manifest)
+        indexed = vector_index.paths()
+        # "chunks" is 0 for files with no text, which are never in the index
+        missing = [path for path, entry in new_manifest.items()
+                   if path not in changed and entry.get("chunks", 1) and path not in indexed]
+        keyword_added = reconcile_keyword_index(new_manifest)
+        if not changed and not removed and not missing and not keyword_added:
+            file_manifest = new_manifest  # picks up touched-but-identical files
+            return
+
+        batch = {}
+        extracted = 0
+        for path, chunks in extract_files(changed + missing):
+            if chunks is None:
+                new_manifest.pop(path, None)  # retried on the next refresh
+                continue
+            extracted += 1
+            new_manifest[path] = {**new_manifest[path], "chunks": len(chunks)}
+            batch[path] = chunks
+            if sum(map(len, batch.values())) >= INDEX_UPDATE_CHUNKS:
+                update_indexes(batch)
+                batch = {}
+        update_indexes(batch, new_manifest)
+
+        # Compared with the last save, not the start of this refresh: a failed refresh may
+        # have updated the indexes in memory already
+        if vector_index.version != saved_index_versions[0]:
+            vector_index.save(INDEX_DIR)
+        if bm25_index.version != saved_index_versions[1]:
+            bm25_index.save(INDEX_DIR)
+        saved_index_versions = (vector_index.version, bm25_index.version)
+        save_manifest(INDEX_DIR, new_manifest)
+        file_manifest = new_manifest
+    print(f"[Background] Re-indexed {extracted} files ({len(missing)} missing from the index), "
+          f"removed {len(removed)}; {len(vector_index)} chunks indexed.")
+
+
+def background_file_cache_refresher(interval_seconds=3600, watch=False):
+    # In watch mode filesystem events wake the loop early; the interval stays as a fallback poll
+    if watch and start_watcher(FILE_FOLDER, file_change_event.set) is None:
+        watch = False
     while True:
         print("[Background] Refreshing file cache...")
-        new_cache = {}
-        p = Path(FILE_FOLDER)
-        for file_path in p.glob("*"):
-            ext = file_path.suffix.lower()
-            try:
-                if ext == ".pdf":
-                    text = extract_text_from_pdf(file_path)
-                elif ext == ".docx":
-                    text = extract_text_from_docx(file_path)
-                elif ext == ".xlsx":
-                    text = extract_text_from_xlsx(file_path)
-                elif ext == ".txt":
-                    text = extract_text_from_txt(file_path)
-                else:
-                    continue
-                new_cache[str(file_path)] = text
-            except Exception as e:
-                print(f"[Background] Error loading {file_path}: {e}")
-        with file_cache_lock:
-            file_cache = new_cache
-        refresh_file_embeddings()  # Update embeddings
-        print(f"[Background] File cache refreshed with {len(file_cache)} files.")
+        try:
+            refresh_file_cache()
+        except Exception as e:
+            print(f"[Background] File cache refresh failed: {e}")
+        documents_indexed.set()
+        file_change_event.wait(interval_seconds)
+        if watch:
+            time.sleep(FILE_WATCH_DEBOUNCE)  # let copies finish and batch bursts of events
+        file_change_event.clear()
+
+
+def load_search_model():
+    model = load_embedding_model(EMBEDDING_MODEL_NAME, EMBED_BACKEND, EMBED_THREADS)
+    if model.get_sentence_embedding_dimension() != EMBEDDING_DIMENSION:
+        raise ValueError(f"{EMBEDDING_MODEL_NAME} embeds into {model.get_sentence_embedding_dimension()} "
+                         f"dimensions, EMBEDDING_DIMENSION is {EMBEDDING_DIMENSION}")
+    return model
+
+# Model for semantic search, loaded on first use (see MODEL_LOADING)
+embedding_model = LazyResource("embedding model", load_search_model)
+CHUNK_OVERLAP_TOKENS = 32
+
+def chunk_max_tokens():
+    # Chunks are sized to what the embedding model actually reads, minus [CLS]/[SEP]
+    return embedding_model.get().max_seq_length - 2
+
+def count_embedding_tokens(text):
+    return len(embedding_model.get().tokenizer(text, add_special_tokens=False)["input_ids"])
+
+# Repeated questions skip re-encoding the query and re-scanning the index
+RETRIEVAL_CANDIDATES = 12  # chunks fetched before merging, dedup and budgeting
+RETRIEVAL_CONTEXT_TOKENS = 1200  # retrieved text per prompt
+QUERY_CACHE_SIZE = 2048
+QUERY_CACHE_TTL = 3600
+query_embedding_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+retrieval_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+# Document answers reused for near-duplicate questions that retrieve the same chunks
+RESPONSE_CACHE_SIMILARITY = 0.95  # cosine similarity of the questions (all-MiniLM-L6-v2)
+RESPONSE_CACHE_CHUNKS = 3  # top chunks that must match between the questions
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_TTL = 86400
+response_cache = SemanticCache(RESPONSE_CACHE_SIMILARITY, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+# All chunk embeddings in one matrix, loaded from disk so restarts skip re-embedding
+vector_index = VectorIndex.load(INDEX_DIR, EMBEDDING_DIMENSION, EMBED_STORAGE_DTYPE)
+# Keyword postings over the same chunks, for exact terms such as codes and names
+bm25_index = BM25Index.load(INDEX_DIR)
+
+
+def bm25_saved_mtime():
+    try:
+        return os.path.getmtime(os.path.join(INDEX_DIR, BM25_FILE))
+    except OSError:
+        return None
+
+bm25_loaded_mtime = bm25_saved_mtime()
+
+# ========== INDEX SHARING ==========
+# With several worker processes, the one holding INDEXER_LOCK_FILE extracts, embeds and
+# publishes new index versions; the others memory-map whatever was published last.
+indexer_lock = None
+saved_index_versions = (0, 0)  # (vector, BM25) versions the indexer last saved or loaded
+
+
+def become_indexer():
+    """Take the indexer lock if it is free; the winner loads the extraction manifest."""
+    global indexer_lock, file_manifest, saved_index_versions
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    indexer_lock = try_lock(os.path.join(INDEX_DIR, INDEXER_LOCK_FILE))
+    if indexer_lock is None:
+        return False
+    reload_published_index()  # another process may have indexed since this one started
+    file_manifest = load_manifest(INDEX_DIR)
+    saved_index_versions = (vector_index.version, bm25_index.version)
+    print(f"[Index] Process {os.getpid()} is the indexer")
+    return True
+
+
+def reload_published_index():
+    global bm25_index, bm25_loaded_mtime
+    changed = vector_index.reload(INDEX_DIR)
+    mtime = bm25_saved_mtime()
+    if mtime != bm25_loaded_mtime:
+        bm25_index = BM25Index.load(INDEX_DIR)  # saved atomically by the indexer
+        bm25_loaded_mtime = mtime
+        changed = True
+    if changed:
+        retrieval_cache.clear()
+        response_cache.clear()  # which files changed is only known to the indexer
+
+
+def follow_published_index(interval_seconds):
+    documents_indexed.set()  # serving the published index; the indexer keeps it current
+    while True:
         time.sleep(interval_seconds)
+        if become_indexer():  # the indexer exited; take over
+            background_file_cache_refresher(FILE_REFRESH_INTERVAL, FILE_REFRESH_MODE == "watch")
+            return
+        try:
+            reload_published_index()
+        except Exception as e:
+            print(f"[Index] Reloading the published index failed: {e}")
+
+def reconcile_keyword_index(manifest):
+    """Add the files BM25 lacks from the chunks the vector index stores; returns how many.
+
+    Covers an index built before BM25 existed or a lost bm25.json without
+    extracting anything again.
+    """
+    missing = (vector_index.paths() & set(manifest)) - bm25_index.paths()
+    if missing:
+        bm25_index.update({path: vector_index.records_for(path) for path in missing})
+        retrieval_cache.clear()
+        response_cache.invalidate(missing)
+        print(f"[Index] Added {len(missing)} files to the BM25 index from the vector index")
+    return len(missing)
+
+
+def update_indexes(files, manifest=None):
+    """Merge the chunks of ``files`` (path -> chunk dicts) into both indexes, in memory.
+
+    Files whose chunks are already indexed are not re-embedded. With
+    ``manifest``, indexed paths it does not list are dropped as well.
+    """
+    vector_files = {}
+    keyword_files = {}
+    for path, file_chunks in files.items():
+        chunks = [chunk["text"] for chunk in file_chunks]
+        metas = [{key: value for key, value in chunk.items() if key != "text"} for chunk in file_chunks]
+        if chunks != bm25_index.chunks_for(path):
+            keyword_files[path] = (chunks, metas)
+        if chunks != vector_index.chunks_for(path):
+            vector_files[path] = (chunks, metas)
+
+    # One batched encode over the chunks of every changed file, then split per file
+    all_chunks = [chunk for chunks, _ in vector_files.values() for chunk in chunks]
+    embeddings = encode_corpus(embedding_model.get(), all_chunks, EMBED_BATCH_SIZE) if all_chunks else None
+    start = 0
+    for path, (chunks, metas) in vector_files.items():
+        vector_files[path] = (chunks, metas, embeddings[start:start + len(chunks)])
+        start += len(chunks)
+
+    removed = vector_index.paths() - set(manifest) if manifest is not None else set()
+    if vector_files or removed:
+        vector_index.update(vector_files, removed)
+        retrieval_cache.clear()  # entries for the old version can no longer be hit
+        response_cache.invalidate(set(vector_files) | removed)
+        print(f"[Index] Re-embedded {len(vector_files)} files, removed {len(removed)}; {len(vector_index)} chunks indexed")
+
+    keyword_removed = bm25_index.paths() - set(manifest) if manifest is not None else set()
+    if keyword_files or keyword_removed:
+        bm25_index.update(keyword_files, keyword_removed)
+        retrieval_cache.clear()
+        response_cache.invalidate(set(keyword_files) | keyword_removed)
+        print(f"[Index] Re-indexed {len(keyword_files)} files for BM25, removed {len(keyword_removed)}")
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+def embed_query(query):
+    key = normalize_query(query)
+    query_embedding = query_embedding_cache.get(key)
+    if query_embedding is None:
+        with metrics.span("query_embedding"):
+            query_embedding = embedding_model.get().encode(key, convert_to_numpy=True, normalize_embeddings=True)
+        query_embedding_cache.set(key, query_embedding)
+    return query_embedding
+
+def semantic_search_hits(query, top_k=3):
+    """Return the ``top_k`` most similar chunks across all files as index hits."""
+    # The index version is part of the key, so any re-index invalidates old results
+    key = (normalize_query(query), top_k, vector_index.version)
+    hits = retrieval_cache.get(key)
+    if hits is None:
+        query_embedding = embed_query(query)
+        with metrics.span("vector_search"):
+            hits = vector_index.search(query_embedding, top_k)
+        retrieval_cache.set(key, hits)
+    return hits
+
+query_router = QueryRouter(embed_query)
+
+# Whole words only, so "this", "which" or "they" never read as a greeting; longer
+# messages that open with one ("Hi, what does VESG-2 say about ...") still go to the router
+GREETING_RE = re.compile(r"\b(hello|hi|hey|how are you|good (morning|afternoon|evening)|thanks|thank you)\b", re.IGNORECASE)
+GREETING_MAX_WORDS = 6
+
+
+def is_simple_greeting(text):
+    return len(text.split()) <= GREETING_MAX_WORDS and GREETING_RE.search(text) is not None
+
+def hybrid_search_hits(query, top_k=RETRIEVAL_CANDIDATES):
+    """Fuse the semantic and BM25 rankings of ``query`` with reciprocal rank fusion.
+
+    Each hit's score is its fused score relative to the best hit, in (0, 1].
+    """
+    key = ("hybrid", normalize_query(query), top_k, vector_index.version, bm25_index.version)
+    hits = retrieval_cache.get(key)
+    if hits is not None:
+        return hits
+
+    semantic_hits = semantic_search_hits(query, top_k)
+    with metrics.span("keyword_search"):
+        keyword_hits = bm25_index.search(query, top_k)
+    fused = reciprocal_rank_fusion(semantic_hits, keyword_hits)[:top_k]
+    # Keyword-only hits still need their embeddings for MMR in the context assembly
+    missing = [(hit["path"], hit["offset"]) for _, hit in fused if "embedding" not in hit]
+    found = {}
+    if missing:
+        found = {(hit["path"], hit["offset"]): hit for hit in vector_index.lookup(missing, embed_query(query))}
+
+    hits = []
+    for score, hit in fused:
+        if "embedding" not in hit:
+            hit = found.get((hit["path"], hit["offset"]))
+            if hit is None:
+                continue  # not embedded yet
+        hits.append({**hit, "score": score / fused[0][0]})
+    retrieval_cache.set(key, hits)
+    return hits
+
+def hybrid_search_files(query, top_k=RETRIEVAL_CANDIDATES):
+    """Return ``(context, sources)`` built from the ``top_k`` best chunks across all files."""
+    hits = hybrid_search_hits(query, top_k)
+    with metrics.span("context_assembly"):
+        return retrieval_context.assemble_context(hits, RETRIEVAL_CONTEXT_TOKENS, count_tokens)
+
+def response_cache_chunks(question):
+    """The ``(path, offset)`` ids of the chunks ``question`` retrieves best (cached by semantic_search_hits)."""
+    return [(hit["path"], hit["offset"]) for hit in semantic_search_hits(question, RETRIEVAL_CANDIDATES)[:RESPONSE_CACHE_CHUNKS]]
+
+def response_cache_applies(conversation_id):
+    """Whether a reply in this conversation can be shared through the response cache.
+
+    Replies are generated from the conversation's history and summary as well as
+    the question, so only a conversation's first question is answered from, or
+    stored in, the cache; a follow-up like "and the second one?" never is.
+    """
+    meta = conversation_store.get_conversation_meta(conversation_id)
+    summary, _ = conversation_store.get_summary(conversation_id)
+    return meta is not None and meta["message_count"] == 0 and not summary
+
+def cached_answer(question):
+    """Return ``{"content", "sources"}`` stored for a near-duplicate of ``question``, or None."""
+    with metrics.span("response_cache"):
+        return response_cache.get(embed_query(question), MODEL_NAME, response_cache_chunks(question))
+
+def remember_answer(question, content, sources, seconds):
+    """Cache a generated answer grounded in documents, see response_cache_applies."""
+    if not sources or not content or content in (LLM_ERROR_REPLY, BACKEND_UNAVAILABLE_REPLY):
+        return
+    response_cache.set(normalize_query(question), embed_query(question), MODEL_NAME,
+                       response_cache_chunks(question), {"content": content, "sources": sources}, seconds)
+
+
+
+# ========== APP SETUP ==========
+app = cors(Quart(__name__), allow_origin="*")
+
+
+@app.before_serving
+async def startup():
+    global title_queue, title_task
+    await open_http_session()
+    title_queue = asyncio.Queue()
+    title_task = asyncio.create_task(title_worker())
+    if MODEL_LOADING == "background":
+        warm_models()
+    start_index_worker()
+
+
+@app.after_serving
+async def shutdown():
+    if title_task is not None:
+        title_task.cancel()
+    await close_http_session()
+
+
+@app.before_request
+async def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+async def record_request_time(response):
+    started = getattr(g, "request_started", None)
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or "unmatched",
+                                     method=request.method, status=response.status_code)
+    return response
 
+# ========== UTILITY FUNCTIONS ==========
+# Conversations are stored in SQLite (see conversation_store.py); the old
+# conversations.json file is imported once on first start.
+image_store.init_image_store(IMAGE_DIR)
+conversation_store.init_store(CONVERSATION_DB, legacy_json=CONVERSATION_FILE,
+                              save_image=image_store.save_image, decode_image=image_store.decode_data_url)
 
-# Load model for semantic search
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+def page_size(default):
+    return max(1, min(request.args.get("limit", default, type=int), MAX_PAGE_SIZE))
 
-# Cache for precomputed embeddings
-file_embeddings = {}  # {path: {"chunks": [], "embeddings": []}}
 
-def chunk_text(text, max_length=100, overlap=20):
-    words = text.split()
-    chunks = []
-    for i in range(0, len(words), max_length - overlap):
-        chunk = " ".join(words[i:i + max_length])
-        chunks.append(chunk)
-    return chunks
+def encode_cursor(cursor):
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
 
-def refresh_file_embeddings():
-    global file_embeddings
-    texts = load_all_files()
-    file_embeddings = {}
-    for path, content in texts.items():
-        chunks = chunk_text(content)
-        embeddings = embedding_model.encode(chunks, convert_to_tensor=True)
-        file_embeddings[path] = {"chunks": chunks, "embeddings": embeddings}
 
-def semantic_search_files(query, top_k=3):
-    query_embedding = embedding_model.encode(query, convert_to_tensor=True)
-    results = []
+def decode_cursor(value):
+    """Opaque ``?cursor=`` string back to ``(updated_at, id)``; raises ValueError if malformed."""
+    try:
+        updated_at, cid = json.loads(base64.urlsafe_b64decode(value.encode()))
+        return float(updated_at), str(cid)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {value}") from e
 
-    for path, data in file_embeddings.items():
-        cos_scores = util.cos_sim(query_embedding, data["embeddings"]).cpu().numpy()[0]
-        top_indices = np.argsort(cos_scores)[-top_k:][::-1]
 
-        for idx in top_indices:
-            snippet = data["chunks"][idx]
-            results.append(f"...{snippet.strip()}...")
 
-    return "\n".join(results) if results else None
+# ========== CONVERSATION CONTEXT ==========
+context_tokenizer = LazyResource("context tokenizer", lambda: context_builder.load_token_counter(CONTEXT_TOKENIZER))
 
 
+def count_tokens(text):
+    return context_tokenizer.get()(text)
 
-# ========== FLASK SETUP ==========
-app = Flask(__name__)
-CORS(app)
+summary_tasks = set()  # conversation ids with a summary update in flight
 
-# ========== UTILITY FUNCTIONS ==========
-def load_conversations():
-    if os.path.exists(CONVERSATION_FILE):
-        try:
-            with open(CONVERSATION_FILE, "r") as f:
-                data = json.load(f)
-                print(f"[DEBUG] Loaded {len(data)} conversations")
-                return data
-        except Exception as e:
-            print(f"Error loading conversations: {e}")
-            return {}
-    print(f"[DEBUG] No conversation file found at {CONVERSATION_FILE}")
-    return {}
-
-def save_conversations(data):
-    print(f"Saving conversations to: {os.path.abspath(CONVERSATION_FILE)}")
-    print(f"Current working directory: {os.getcwd()}")
-    try:
-        with open(CONVERSATION_FILE, "w") as f:
-            json.dump(data, f, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
-        print(f"Data length: {len(json.dumps(data))}")
-        print(f"Conversations saved successfully")
-    except Exception as e:
-        print(f"Error saving conversations: {e}")
 
+def conversation_prompt(conversation_id, prompt, before=None):
+    """Pack the rolling summary and recent turns of a conversation around a single-turn ``prompt``.
 
+    ``before`` limits the history to messages with a lower index (when editing a message).
+    """
+    summary, covered = conversation_store.get_summary(conversation_id)
+    history, start = conversation_store.get_messages_page(conversation_id, before, CONTEXT_HISTORY_MESSAGES)
+    if before is not None and covered > before:
+        summary, covered = "", 0
+    history = history[max(0, covered - start):]
+    return context_builder.pack_prompt(prompt, history, summary, CONTEXT_WINDOW - CONTEXT_REPLY_TOKENS, count_tokens)
 
-# ========== FILE SEARCH HELPERS ==========
 
-FILE_FOLDER = r"C:\Users\user\Desktop\LPEE BOT\backend\files"
-file_cache = {}
-file_cache_lock = Lock()
+def schedule_summary_update(conversation_id):
+    """Fold turns that left the recent window into the summary, off the request path."""
+    if conversation_id in summary_tasks:
+        return
+    summary_tasks.add(conversation_id)
+    task = asyncio.create_task(update_summary(conversation_id))
+    task.add_done_callback(lambda _: summary_tasks.discard(conversation_id))
 
-def extract_text_from_pdf(path):
-    text = []
-    try:
-        with open(path, "rb") as f:
-            reader = PyPDF2.PdfReader(f)
-            for page in reader.pages:
-                raw = page.extract_text()
-                if raw:
-                    # Normalize spacing and fix broken lines
-                    raw = re.sub(r'(?<!\.)\s+$', '', raw.strip())  # remove trailing space
-                    raw = re.sub(r'(\w+)-\n(\w+)', r'\1\2', raw)  # fix hyphenated words split across lines
-                    raw = re.sub(r'([a-zA-Z])- ([a-zA-Z])', r'\1\2', raw)  # fix word breaks
-                    text.append(raw)
-    except Exception as e:
-        print(f"PDF extraction error for {path}: {e}")
-    return "\n".join(text)
 
-def extract_text_from_docx(path):
-    text = []
+async def update_summary(conversation_id):
     try:
-        doc = docx.Document(path)
-        for para in doc.paragraphs:
-            text.append(para.text)
+        while True:
+            summary, covered = conversation_store.get_summary(conversation_id)
+            meta = conversation_store.get_conversation_meta(conversation_id)
+            if meta is None:
+                return
+            target = min(meta["message_count"] - SUMMARY_KEEP_RECENT, covered + SUMMARY_MAX_STEP)
+            if target - covered < SUMMARY_BATCH:
+                return
+
+            aged, _ = conversation_store.get_messages_page(conversation_id, target, target - covered)
+            data = await ollama_chat({
+                "model": MODEL_NAME,
+                "messages": context_builder.summary_prompt(summary, aged, SUMMARY_INPUT_TOKENS, count_tokens),
+                "options": {"num_ctx": CONTEXT_WINDOW, "num_predict": 300},
+            }, priority=BACKGROUND)
+            new_summary = data["message"]["content"].strip()
+            if not new_summary or not conversation_store.set_summary(conversation_id, new_summary, target, expected_covered=covered):
+                return
+            print(f"[Context] Summary of {conversation_id} now covers {target} messages")
+    except LLMQueueFull:
+        return  # Ollama is saturated; the next reply schedules the summary again
     except Exception as e:
-        print(f"DOCX extraction error for {path}: {e}")
-    return "\n".join(text)
+        print(f"[ERROR] Summary update failed for {conversation_id}: {e}")
 
-def extract_text_from_xlsx(path):
-    text = []
-    try:
-        wb = openpyxl.load_workbook(path, data_only=True)
-        for sheet in wb.worksheets:
-            for row in sheet.iter_rows(values_only=True):
-                line = " ".join([str(cell) if cell is not None else "" for cell in row])
-                text.append(line)
-    except Exception as e:
-        print(f"XLSX extraction error for {path}: {e}")
-    return "\n".join(text)
 
-def extract_text_from_txt(path):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()
-    except Exception as e:
-        print(f"TXT extraction error for {path}: {e}")
-        return ""
+# ========== CONVERSATION TITLES ==========
+# Titles are made by one background worker, a conversation at a time; a conversation
+# queued again before its turn is only generated once.
+title_queue = None
+title_task = None
+queued_titles = set()
 
-def load_all_files():
-    global file_cache
-    with file_cache_lock:
-        return file_cache
 
+def schedule_title(conversation_id):
+    if conversation_id in queued_titles:
+        return
+    queued_titles.add(conversation_id)
+    title_queue.put_nowait(conversation_id)
 
-def search_files_for_answer(query):
-    texts = load_all_files()
-    results = []
-    pattern = re.compile(re.escape(query), re.IGNORECASE)
-    for path, content in texts.items():
-        if pattern.search(content):
-            snippet_start = content.lower().find(query.lower())
-            snippet_end = snippet_start + 300 if snippet_start >= 0 else 300
-            snippet = content[snippet_start:snippet_end].replace("\n", " ").strip()
-            results.append(f"From {path}: ...{snippet}...")
-    return "\n\n".join(results) if results else None
 
+async def title_worker():
+    while True:
+        conversation_id = await title_queue.get()
+        queued_titles.discard(conversation_id)
+        try:
+            await generate_title(conversation_id)
+        except LLMQueueFull:
+            pass  # the frontend asks again after the next reply while the title is still Untitled
+        except Exception as e:
+            print(f"[ERROR] Title generation failed for {conversation_id}: {e}")
+
+
+def encode_normalized(texts):
+    return embedding_model.get().encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+
+
+async def generate_title(conversation_id):
+    meta = conversation_store.get_conversation_meta(conversation_id)
+    if meta is None or meta["title"] != "Untitled":
+        return
+    messages, _ = conversation_store.get_messages_page(conversation_id, 5, 5)
+
+    title = None
+    first_question = next((msg["content"] for msg in messages if msg["role"] == "user" and msg["content"]), None)
+    if TITLE_KEYWORDS and first_question:
+        with metrics.span("title_keywords"):
+            title = await asyncio.to_thread(titles.keyword_title, first_question, encode_normalized)
+
+    if title is None:
+        prompt_lines = [
+            "Generate a concise and professional title based on the following conversation.",
+            "Do NOT use quotation marks or emojis.",
+            "Examples: 'Mathematics Problem', 'AI Ethics', 'Software Development Help'",
+            "\n---\nConversation:\n"
+        ]
+        for msg in messages:
+            role = "User" if msg["role"] == "user" else "Assistant"
+            prompt_lines.append(f"{role}: {msg['content']}")
+
+        with metrics.span("title_generation"):
+            data = await ollama_chat({
+                "model": MODEL_NAME,
+                "messages": [
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": "\n".join(prompt_lines)}
+                ]
+            }, priority=BACKGROUND)
+        title = data["message"]["content"].strip()
 
+    if title:
+        conversation_store.set_title(conversation_id, title)
+
+
+# ========== FILE SEARCH HELPERS ==========
+
+FILE_FOLDER = r"C:\Users\user\Desktop\LPEE BOT\backend\files"
+FILE_REFRESH_MODE = "poll"  # "poll" every FILE_REFRESH_INTERVAL, or "watch" for filesystem events
+FILE_REFRESH_INTERVAL = 3600
+FILE_WATCH_DEBOUNCE = 2
+SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".xlsx", ".txt"}
+# Files indexed by a previous run are only extracted again once the manifest says they
+# changed; only the indexer process loads it (see become_indexer)
+file_manifest = {}
+index_refresh_lock = threading.Lock()  # the background refresh and /api/refresh-embeddings
+INDEX_UPDATE_CHUNKS = 4096  # embedded chunks merged into the indexes at a time during a refresh
+file_change_event = threading.Event()
+documents_indexed = threading.Event()  # set once the first refresh at startup has run
+EXTRACT_WORKERS = os.cpu_count() or 1
+PDF_PAGES_PER_PART = 25
+EXTRACT_MAX_PENDING = EXTRACT_WORKERS * 2  # parts in flight; bounds the results buffered out of page order
+extract_pool = None
+
+def get_extract_pool():
+    global extract_pool
+    if extract_pool is None:
+        # Never fork: this process already runs the STT worker, model warm-up and
+        # event loop threads, and a fork can inherit their locks held. Workers only
+        # import extractors.py; forkserver where available, spawn elsewhere
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(method)
+        if method == "forkserver":
+            context.set_forkserver_preload(["extractors"])
+        extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=context)
+    return extract_pool
+
+def extract_files(paths):
+    """Extract ``paths`` across the process pool, chunking pages as they arrive.
+
+    PDFs are split into ranges of PDF_PAGES_PER_PART pages. Ranges are submitted
+    in order, at most EXTRACT_MAX_PENDING at a time, and fed to each file's
+    chunker in page order as soon as they are contiguous, then released, so
+    only a file's chunks are kept until it completes. Yields ``(path, chunks)``
+    per file as it completes, with ``chunks`` None if extraction failed.
+    """
+    pool = get_extract_pool()
+    state = {}
+
+    def parts():
+        for path in paths:
+            ranges = extractors.plan_parts(path, PDF_PAGES_PER_PART)
+            state[path] = {"parts": len(ranges), "next": 0, "done": {}, "failed": False, "chunks": [],
+                           "chunker": StructuredChunker(count_embedding_tokens, chunk_max_tokens(), CHUNK_OVERLAP_TOKENS)}
+            for i, (start, end) in enumerate(ranges):
+                yield path, i, start, end
+
+    tasks = parts()
+    pending = {}
+    while True:
+        for path, part, start, end in itertools.islice(tasks, EXTRACT_MAX_PENDING - len(pending)):
+            pending[pool.submit(extractors.extract_part, path, start, end)] = (path, part)
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            path, part = pending.pop(future)
+            s = state[path]
+            try:
+                s["done"][part] = future.result()
+            except Exception as e:
+                print(f"[Background] Extraction failed for {path} part {part}: {e}")
+                s["failed"] = True
+                s["done"][part] = []
 
+            while s["next"] in s["done"]:
+                blocks = s["done"].pop(s["next"])
+                if not s["failed"]:
+                    s["chunks"].extend(s["chunker"].feed(blocks))
+                s["next"] += 1
+
+            if s["next"] == s["parts"]:
+                del state[path]
+                yield path, None if s["failed"] else s["chunks"] + s["chunker"].close()
 
 
 # ========== API ROUTES ==========
 
 @app.route('/api/stt', methods=['POST'])
-def stt():
+async def stt():
     try:
-        audio_file = request.files['audio']
+        files = await request.files
+        audio_file = files.get('audio')
         if not audio_file:
             return jsonify({ 'error': 'No audio file uploaded' }), 400
 
-        # Save uploaded audio to a temporary file
-        with tempfile.NamedTemporaryFile(suffix=".webm", delete=False) as temp_input:
-            temp_input.write(audio_file.read())
-            temp_input.flush()
-            input_path = temp_input.name
-
-        # Convert WebM to WAV using ffmpeg subprocess
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_wav:
-            output_path = temp_wav.name
+        # Decode in memory to 16 kHz mono float32, then wait for the STT worker
+        with metrics.span("stt_decode"):
+            audio = await asyncio.to_thread(decode_audio, audio_file.read())
+        with metrics.span("stt_transcribe"):
+            text = await asyncio.wrap_future(stt_worker.submit(audio))
 
-        subprocess.run([
-            "ffmpeg", "-y", "-i", input_path, "-ar", "16000", "-ac", "1", output_path
-        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return jsonify({ 'text': text })
 
-        # Load WAV and transcribe
-        audio_data, sr = sf.read(output_path)
-        result = whisper_model.transcribe(output_path, fp16=False)
-        text = result['text'].strip()
+    except STTQueueFull:
+        return jsonify({ 'error': 'Speech-to-text is busy, please try again' }), 429
 
-        return jsonify({ 'text': text })
+    except ValueError as e:
+        print("STT error:", e)
+        return jsonify({ 'error': 'Could not decode the audio file' }), 400
 
     except Exception as e:
         print("STT error:", e)
         return jsonify({ 'error': 'Error converting speech to text' }), 500
 
+@app.websocket('/api/stt/stream')
+async def stt_stream():
+    """Incremental speech-to-text.
+
+    The client sends 16 kHz mono int16 PCM as binary frames while recording and
+    ``{"type": "stop"}`` when done. The server answers with
+    ``{"type": "partial", "segment": n, "text": ...}`` while an utterance is in
+    progress, ``{"type": "segment", ...}`` once it ends, and a closing
+    ``{"type": "final", "text": ...}`` with the whole transcript.
+    """
+    segmenter = SpeechSegmenter()
+    committed = []
+    partial_task = None
+
+    async def send(payload):
+        await websocket.send(json.dumps(payload))
+
+    async def send_partial(segment_no, audio):
+        try:
+            with metrics.span("stt_partial"):
+                text = await asyncio.wrap_future(stt_worker.submit(audio))
+            await send({"type": "partial", "segment": segment_no, "text": text})
+        except STTQueueFull:
+            pass  # partials are best effort; the segment transcript still follows
+
+    async def finish_segment(audio):
+        if partial_task is not None:
+            partial_task.cancel()
+        try:
+            with metrics.span("stt_transcribe"):
+                text = await asyncio.wrap_future(stt_worker.submit(audio))
+        except STTQueueFull:
+            await send({"type": "error", "error": "Speech-to-text is busy, please try again"})
+            return
+        committed.append(text)
+        await send({"type": "segment", "segment": len(committed) - 1, "text": text})
+
+    try:
+        while True:
+            data = await websocket.receive()
+            if isinstance(data, str):
+                if json.loads(data).get("type") == "stop":
+                    break
+                continue
+            for kind, audio in segmenter.feed(pcm16_to_float32(data)):
+                if kind == "segment":
+                    await finish_segment(audio)
+                elif partial_task is None or partial_task.done():
+                    # Only one partial in flight, so partials never queue up behind each other
+                    partial_task = asyncio.create_task(send_partial(len(committed), audio))
+
+        for _, audio in segmenter.flush():
+            await finish_segment(audio)
+        await send({"type": "final", "text": " ".join(text for text in committed if text)})
+    except Exception as e:
+        print("STT stream error:", e)
+    finally:
+        if partial_task is not None:
+            partial_task.cancel()
+
+def build_search_prompt(user_question, query):
+    """Retrieve context for ``query`` and return ``(prompt, sources)``; prompt is None if nothing matched."""
+    file_search_result, sources = hybrid_search_files(query)
+    if not file_search_result:
+        return None, []
+
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You are a helpful assistant answering based ONLY on the following context. "
+                "Do NOT mention documents, excerpts, or context in your answer. Just answer as if you knew it directly."
+                f"\n\nContext:\n{file_search_result}"
+            )
+        },
+        {
+            "role": "user",
+            "content": user_question
+        }
+    ], sources
+
+
+async def build_chat_prompt(user_question, use_cache=False):
+    """Decide how to answer ``user_question``.
+
+    Returns ``(prompt, direct_reply, sources)``: either the messages for the
+    final LLM generation, or ``(None, reply, sources)`` when the MCP step or the
+    response cache (consulted only with ``use_cache``) already answered.
+    ``sources`` cites the file, page and section of retrieved passages.
+    """
+    general_prompt = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": user_question}
+    ]
+
+    # Quick check for simple greetings/conversation that don't need file search
+    with metrics.span("greeting_check"):
+        greeting = is_simple_greeting(user_question)
+
+    if greeting:
+        CHAT_ROUTES.inc(route="greeting")
+        # Generate a simple response without MCP
+        simple_prompt = [
+            {"role": "system", "content": "You are a friendly and helpful assistant. Respond naturally to greetings and casual conversation."},
+            {"role": "user", "content": user_question}
+        ]
+        return simple_prompt, None, []
+
+    # Route locally from embeddings; the retrieved hits are cached for the search below
+    hits = await asyncio.to_thread(semantic_search_hits, user_question, RETRIEVAL_CANDIDATES)
+    cached = await asyncio.to_thread(cached_answer, user_question) if use_cache else None
+    if cached is not None:
+        CHAT_ROUTES.inc(route="cache")
+        return None, cached["content"], cached["sources"]
+
+    with metrics.span("routing"):
+        # Encodes the intent examples on first use and the query on a cache miss
+        route, _ = await asyncio.to_thread(query_router.route, user_question, hits[0]["score"] if hits else 0.0)
+    CHAT_ROUTES.inc(route=route)
+
+    if route == ROUTE_SEARCH:
+        prompt, sources = await asyncio.to_thread(build_search_prompt, user_question, user_question)
+        return prompt or general_prompt, None, sources
+    if route == ROUTE_CHAT:
+        return general_prompt, None, []
+
+    # Ambiguous: fall back to the MCP routing call
+    try:
+        with metrics.span("mcp"):
+            mcp_response = await fetch_real_mcp_reply(user_question)
+
+        if mcp_response.get("search_needed"):
+            query = mcp_response["search_query"]
+            enhanced_prompt, sources = await asyncio.to_thread(build_search_prompt, user_question, query)
+            if enhanced_prompt:
+                return enhanced_prompt, None, sources
+
+        return None, mcp_response.get("assistant_reply") or "", []
+    except LLMQueueFull:
+        raise  # the reply would queue behind the same model; let the route answer 429
+    except Exception as e:
+        print(f"[ERROR] Error in MCP processing: {e}")
+        # Fallback to direct AI response
+        return general_prompt, None, []
+
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def assistant_message(content, sources):
+    message = {"role": "assistant", "content": content}
+    if sources:
+        message["sources"] = sources
+    return message
+
+
+async def stream_chat_reply(conversation_id, user_question, prompt, direct_reply, sources, trace, use_cache):
+    """Relay the reply as Server-Sent Events and save it once the stream ends.
+
+    Emits ``{"token": ...}`` events while generating and a final
+    ``{"done": true, "content": ..., "sources": [...]}`` event with the full reply.
+    """
+    parts = []
+    generated = False
+    try:
+        if prompt is None:
+            parts.append(direct_reply)
+            yield sse_event({"token": direct_reply})
+        else:
+            with metrics.span("generation", trace):
+                async for token in stream_ai_reply(prompt):
+                    if not parts:
+                        FIRST_TOKEN_SECONDS.observe(trace.elapsed())
+                    parts.append(token)
+                    yield sse_event({"token": token})
+            generated = True
+    except Exception as e:
+        if isinstance(e, asyncio.TimeoutError):
+            LLM_TIMEOUTS.inc(call="stream")
+        LLM_FAILURES.inc(call="stream")
+        print(f"[ERROR] Streaming reply failed: {e}")
+        if not parts:
+            parts.append(LLM_BUSY_REPLY if isinstance(e, LLMQueueFull) else BACKEND_UNAVAILABLE_REPLY)
+            yield sse_event({"token": parts[0]})
+    finally:
+        # Runs on client disconnect too, so the user turn is never lost
+        final_reply = "".join(parts)
+        with metrics.span("conversation_save", trace):
+            conversation_store.append_messages(conversation_id, [
+                {"role": "user", "content": user_question},
+                assistant_message(final_reply, sources),
+            ])
+        schedule_summary_update(conversation_id)
+        if generated and use_cache:
+            await asyncio.to_thread(remember_answer, user_question, final_reply, sources, trace.elapsed())
+        log_trace(trace)
+    yield sse_event({"done": True, "content": final_reply, "sources": sources})
+
+
 @app.route('/api/chat', methods=['POST'])
 async def chat():
     try:
-        data = request.get_json()
+        data = await request.get_json()
         messages = data.get("messages", [])
         conversation_id = data.get("conversationId")
+        stream = data.get("stream", False)
 
         if not conversation_id or not messages:
             return jsonify({"error": "Invalid conversation data"}), 400
 
-        user_question = messages[-1]['content']
-        print(f"[DEBUG] User question: {user_question}")
+        if not conversation_store.conversation_exists(conversation_id):
+            return jsonify({"error": "Conversation not found"}), 404
 
-        # Quick check for simple greetings/conversation that don't need file search
-        simple_greetings = ['hello', 'hi', 'hey', 'how are you', 'good morning', 'good afternoon', 'good evening', 'thanks', 'thank you']
-        is_simple_greeting = any(greeting in user_question.lower() for greeting in simple_greetings)
-        
-        if is_simple_greeting:
-            print(f"[DEBUG] Detected simple greeting, skipping MCP and file search")
-            # Generate a simple response without MCP
-            simple_prompt = [
-                {"role": "system", "content": "You are a friendly and helpful assistant. Respond naturally to greetings and casual conversation."},
-                {"role": "user", "content": user_question}
-            ]
-            
-            async with aiohttp.ClientSession() as session:
-                final_reply = await fetch_ai_reply(session, simple_prompt)
-        else:
-            # Use MCP for more complex queries
-            async with aiohttp.ClientSession() as session:
-                try:
-                    mcp_response = await fetch_real_mcp_reply(session, user_question)
-                    print(f"[DEBUG] MCP response: {mcp_response}")
-
-                    final_reply = mcp_response.get("assistant_reply") or ""
-
-                    if mcp_response.get("search_needed"):
-                        query = mcp_response["search_query"]
-                        print(f"[DEBUG] MCP decided to search files with query: {query}")
-
-                        semantic_result = semantic_search_files(query)
-                        if semantic_result:
-                            file_search_result = semantic_result
-                        else:
-                            file_search_result = search_files_for_answer_loose(query)
-
-                        if file_search_result:
-                            print(f"[DEBUG] File search found relevant content, enriching reply...")
-
-                            enhanced_prompt = [
-                                {
-                                    "role": "system",
-                                    "content": (
-                                        "You are a helpful assistant answering based ONLY on the following context. "
-                                        "Do NOT mention documents, excerpts, or context in your answer. Just answer as if you knew it directly."
-                                        f"{file_search_result}"
-                                    )
-                                },
-                                {
-                                    "role": "system",
-                                    "content": f"Context:\n{file_search_result}"
-                                },
-                                {
-                                    "role": "user",
-                                    "content": user_question
-                                }
-                            ]
-
-                            final_reply = await fetch_ai_reply(session, enhanced_prompt)
-                            print(f"[DEBUG] Final enhanced reply with docs: {final_reply}")
-                except Exception as e:
-                    print(f"[ERROR] Error in MCP processing: {e}")
-                    # Fallback to direct AI response
-                    fallback_prompt = [
-                        {"role": "system", "content": "You are a helpful assistant."},
-                        {"role": "user", "content": user_question}
-                    ]
-                    final_reply = await fetch_ai_reply(session, fallback_prompt)
-
-        convos = load_conversations()
-        if conversation_id not in convos:
+        user_question = messages[-1]['content']
+        trace = metrics.start_trace("chat")
+
+        use_cache = response_cache_applies(conversation_id)
+        prompt, final_reply, sources = await build_chat_prompt(user_question, use_cache)
+        if prompt is not None:
+            # Earlier turns come from the store, not the client, within the token budget
+            with metrics.span("prompt_packing"):
+                prompt = await asyncio.to_thread(conversation_prompt, conversation_id, prompt)
+
+        if stream:
+            if prompt is not None:
+                # Reject before the 200 and the event stream start; the stream itself still waits its turn
+                llm_scheduler.check_admission(MODEL_NAME, INTERACTIVE)
+            response = Response(
+                stream_chat_reply(conversation_id, user_question, prompt, final_reply, sources, trace, use_cache),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+            response.timeout = None  # generation may outlast the default response timeout
+            return response
+
+        if prompt is not None:
+            with metrics.span("generation"):
+                final_reply = await fetch_ai_reply(prompt)
+            if use_cache:
+                await asyncio.to_thread(remember_answer, user_question, final_reply, sources, trace.elapsed())
+
+        with metrics.span("conversation_save"):
+            saved = conversation_store.append_messages(conversation_id, [
+                {"role": "user", "content": user_question},
+                assistant_message(final_reply, sources),
+            ])
+        log_trace(trace)
+        if not saved:
             return jsonify({"error": "Conversation not found"}), 404
+        schedule_summary_update(conversation_id)
 
-        convos[conversation_id]["messages"].append({"role": "user", "content": user_question})
-        convos[conversation_id]["messages"].append({"role": "assistant", "content": final_reply})
-        save_conversations(convos)
+        return jsonify({"content": final_reply, "sources": sources})
 
-        return jsonify({"content": final_reply})
-                
+    except LLMQueueFull:
+        return llm_busy_response()
     except Exception as e:
         print(f"[ERROR] Error in chat endpoint: {e}")
         return jsonify({"error": "Internal server error"}), 500
@@ -449,142 +1206,178 @@ async def chat():
 
 
 @app.route('/api/health', methods=['GET'])
-def health_check():
-    """Health check endpoint to test Ollama connectivity"""
+async def health_check():
+    """Ollama connectivity plus the readiness of each local subsystem.
+
+    ``ready`` is true once the models are loaded and the documents indexed;
+    with ``MODEL_LOADING = "lazy"`` a model that was never used reports ``not_loaded``.
+    """
+    subsystems = {model.name: model.status() for model in MODELS}
+    subsystems["documents"] = {"state": "ready" if documents_indexed.is_set() else "loading",
+                               "chunks": len(vector_index)}
+    readiness = {
+        "ready": all(subsystem["state"] == "ready" for subsystem in subsystems.values()),
+        "subsystems": subsystems,
+    }
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=10)
-        if response.ok:
-            return jsonify({"status": "healthy", "ollama": "connected"})
-        else:
-            return jsonify({"status": "unhealthy", "ollama": "error", "status_code": response.status_code}), 500
-    except requests.exceptions.Timeout:
-        return jsonify({"status": "unhealthy", "ollama": "timeout"}), 500
-    except requests.exceptions.ConnectionError:
-        return jsonify({"status": "unhealthy", "ollama": "connection_error"}), 500
+        async with http_session.get(OLLAMA_TAGS_URL, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if response.ok:
+                return jsonify({"status": "healthy", "ollama": "connected", **readiness})
+            else:
+                return jsonify({"status": "unhealthy", "ollama": "error", "status_code": response.status, **readiness}), 500
+    except asyncio.TimeoutError:
+        return jsonify({"status": "unhealthy", "ollama": "timeout", **readiness}), 500
+    except aiohttp.ClientConnectionError:
+        return jsonify({"status": "unhealthy", "ollama": "connection_error", **readiness}), 500
     except Exception as e:
-        return jsonify({"status": "unhealthy", "ollama": "error", "message": str(e)}), 500
+        return jsonify({"status": "unhealthy", "ollama": "error", "message": str(e), **readiness}), 500
 
 @app.route('/api/refresh-embeddings', methods=['POST'])
-def refresh_embeddings():
+async def refresh_embeddings():
+    if indexer_lock is None:
+        return jsonify({"error": "Another worker process is the indexer"}), 409
     print("[Manual Refresh] Refreshing embeddings...")
-    refresh_file_embeddings()
+    await asyncio.to_thread(refresh_file_cache, True)
     return jsonify({"status": "Embeddings refreshed"})
 
 
+@app.route('/api/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "query_embeddings": query_embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+        "responses": response_cache.stats(),
+        "index_version": vector_index.version,
+        "bm25_version": bm25_index.version,
+        "index_published": vector_index.published,
+    })
 
 
-# Helper: Loose matching file search function
-def search_files_for_answer_loose(query, context_chars=300):
-    texts = load_all_files()
-    results = []
-    query_lower = query.lower()
-    words = set(w for w in re.findall(r'\w+', query_lower) if len(w) > 2)
-    if not words:
-        return None
+@app.route('/api/stt-stats', methods=['GET'])
+def stt_stats():
+    return jsonify({
+        **stt_worker.stats,
+        "backend": STT_BACKEND,
+        "queue_depth": stt_worker.queue_depth(),
+        "real_time_factor": stt_worker.real_time_factor(),
+    })
 
-    for path, content in texts.items():
-        content_lower = content.lower()
-        # Find first occurrence of any keyword
-        idx = -1
-        for word in words:
-            i = content_lower.find(word)
-            if i != -1 and (idx == -1 or i < idx):
-                idx = i
-        if idx == -1:
-            continue
-        start = max(0, idx - context_chars)
-        end = min(len(content), idx + context_chars)
-        snippet = content[start:end].replace("\n", " ").strip()
-        results.append(f"...{snippet}...")
-    return "\n\n".join(results) if results else None
 
+@app.route('/api/router-stats', methods=['GET'])
+def router_stats():
+    with mcp_stats_lock:
+        mcp = dict(mcp_stats)
+    return jsonify({**query_router.stats(), "mcp": mcp})
 
 
+metrics.Gauge("lpee_stt_queue_depth", "Clips waiting for the speech-to-text worker.", stt_worker.queue_depth)
+metrics.Gauge("lpee_stt_rejected_total", "Clips refused because the STT queue was full.",
+              lambda: stt_worker.stats["rejected"], kind="counter")
+metrics.Gauge("lpee_llm_in_flight", "Ollama calls running, by model.",
+              lambda: {(model,): q["in_flight"] for model, q in llm_scheduler.stats().items()}, ["model"])
+metrics.Gauge("lpee_llm_queue_depth", "Ollama calls waiting for a slot, by model.",
+              lambda: {(model,): q["waiting"] for model, q in llm_scheduler.stats().items()}, ["model"])
+metrics.Gauge("lpee_llm_rejected_total", "Ollama calls refused because the model's queue was full.",
+              lambda: dict(llm_scheduler.rejected), ["model", "priority"], kind="counter")
+metrics.Gauge("lpee_indexed_chunks", "Chunks in each retrieval index.",
+              lambda: {("vector",): len(vector_index), ("bm25",): len(bm25_index)}, ["index"])
+metrics.Gauge("lpee_cache_requests_total", "Cache lookups by cache and result.", lambda: {
+    (name, result): cache.stats()[result]
+    for name, cache in (("query_embeddings", query_embedding_cache), ("retrieval", retrieval_cache),
+                        ("responses", response_cache))
+    for result in ("hits", "misses")
+}, ["cache", "result"], kind="counter")
+metrics.Gauge("lpee_response_cache_seconds_saved_total", "Request time saved by answers served from the response cache.",
+              lambda: response_cache.stats()["seconds_saved"], kind="counter")
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 
 @app.route('/api/test-files', methods=['GET'])
 def test_files():
-    files = load_all_files()
+    files = sorted(vector_index.paths())
     return jsonify({
         "file_count": len(files),
-        "files": list(files.keys())
+        "files": files
     })
 
 
 
 
 @app.route('/api/conversations', methods=['GET', 'POST'])
-def conversations():
-    print("Hit /api/conversations route with method", request.method)
-
-    convos = load_conversations()
-
+async def conversations():
     if request.method == 'POST':
         new_id = str(uuid.uuid4())
-        convos[new_id] = {
-            "title": "Untitled",
-            "messages": []
-        }
-        save_conversations(convos)
+        conversation_store.create_conversation(new_id, "Untitled")
         return jsonify({"id": new_id})
 
-    return jsonify(convos)
+    # Summaries only, newest first; message bodies come from the messages endpoint
+    cursor = request.args.get("cursor")
+    try:
+        cursor = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    summaries, next_cursor = conversation_store.list_conversation_summaries(page_size(CONVERSATION_PAGE_SIZE), cursor)
+    return jsonify({
+        "conversations": [{
+            "id": row["id"],
+            "title": row["title"],
+            "updatedAt": row["updated_at"],
+            "messageCount": row["message_count"],
+        } for row in summaries],
+        "nextCursor": encode_cursor(next_cursor),
+    })
+
+@app.route('/api/conversations/<conversation_id>/messages', methods=['GET'])
+def conversation_messages(conversation_id):
+    meta = conversation_store.get_conversation_meta(conversation_id)
+    if meta is None:
+        return jsonify({"error": "Conversation not found"}), 404
+
+    before = request.args.get("before", type=int)
+    messages, start = conversation_store.get_messages_page(conversation_id, before, page_size(MESSAGE_PAGE_SIZE))
+    return jsonify({
+        "title": meta["title"],
+        "messages": messages,
+        "start": start,  # index of messages[0]; pass it as ?before= for the previous page
+        "messageCount": meta["message_count"],
+        "hasMore": start > 0,
+    })
 
 @app.route('/api/conversations/<conversation_id>', methods=['DELETE'])
 def delete_conversation(conversation_id):
-    convos = load_conversations()
-    if conversation_id in convos:
-        del convos[conversation_id]
-        save_conversations(convos)
+    if conversation_store.delete_conversation(conversation_id):
         return jsonify({"status": "deleted"})
     return jsonify({"error": "Conversation not found"}), 404
 
 @app.route('/api/update-title', methods=['POST'])
-def update_title():
-    data = request.get_json()
+async def update_title():
+    """Queue a title for the conversation; poll its messages endpoint for the result."""
+    data = await request.get_json()
     conversation_id = data.get("conversationId")
-    messages = data.get("messages", [])
-    convos = load_conversations()
-
-    if not conversation_id or len(messages) < 2:
+    if not conversation_id:
         return jsonify({"status": "ignored"})
 
-    if convos[conversation_id]["title"] != "Untitled":
-        return jsonify({"status": "title_already_set", "title": convos[conversation_id]["title"]})
+    meta = conversation_store.get_conversation_meta(conversation_id)
+    if meta is None:
+        return jsonify({"error": "Conversation not found"}), 404
 
-    prompt_lines = [
-        "Generate a concise and professional title based on the following conversation.",
-        "Do NOT use quotation marks or emojis.",
-        "Examples: 'Mathematics Problem', 'AI Ethics', 'Software Development Help'",
-        "\n---\nConversation:\n"
-    ]
-    for msg in messages[:5]:
-        role = "User" if msg["role"] == "user" else "Assistant"
-        prompt_lines.append(f"{role}: {msg['content']}")
-    prompt = "\n".join(prompt_lines)
+    if meta["title"] != "Untitled":
+        return jsonify({"status": "title_already_set", "title": meta["title"]})
 
-    try:
-        response = requests.post(OLLAMA_URL, json={
-            "model": MODEL_NAME,
-            "messages": [
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            "stream": False
-        })
-        if response.ok:
-            title = response.json()["message"]["content"].strip()
-            if title:
-                convos[conversation_id]["title"] = title
-                save_conversations(convos)
-                return jsonify({"status": "title_updated", "title": title})
-    except Exception as e:
-        print(f"Error generating title: {e}")
+    if meta["message_count"] < 2:
+        return jsonify({"status": "ignored"})
 
-    return jsonify({"status": "title_update_failed"})
+    schedule_title(conversation_id)
+    return jsonify({"status": "title_queued"}), 202
 
 @app.route('/api/edit-message', methods=['POST'])
-def edit_message():
-    data = request.get_json()
+async def edit_message():
+    data = await request.get_json()
     conversation_id = data.get("conversationId")
     message_index = data.get("messageIndex")
     new_content = data.get("newContent")
@@ -593,119 +1386,114 @@ def edit_message():
     if not all([conversation_id, message_index is not None, new_content]):
         return jsonify({"error": "Missing data"}), 400
 
-    convos = load_conversations()
-    if conversation_id not in convos:
+    if not conversation_store.conversation_exists(conversation_id):
         return jsonify({"error": "Conversation not found"}), 404
 
-    messages = convos[conversation_id]["messages"]
-
-    if message_index >= len(messages) or messages[message_index]["role"] != "user":
+    # Only the edited user message is read; its reply and everything after it are replaced on save
+    page, start = conversation_store.get_messages_page(conversation_id, message_index + 1, 1)
+    if not page or start != message_index or page[0]["role"] != "user":
         return jsonify({"error": "Invalid message index or not a user message"}), 400
 
-    if message_index + 1 >= len(messages) or messages[message_index + 1]["role"] != "assistant":
-        return jsonify({"error": "No assistant reply to update"}), 400
-
-    # Truncate everything after this user + assistant pair
-    del messages[message_index + 2:]
-
     # Update user message
-    messages[message_index]["content"] = new_content
+    user_message = {**page[0], "content": new_content}
 
     # Regenerate assistant reply
     try:
         # Use llava model if the message has an image, otherwise use regular model
         model_to_use = "llava" if has_image else MODEL_NAME
         
-        # Prepare messages for the API call
-        messages_for_api = messages[:message_index + 1]
+        # Prepare messages for the API call: earlier turns within the token budget
+        messages_for_api = await asyncio.to_thread(conversation_prompt, conversation_id, [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": new_content},
+        ], message_index)
         
-        # If it's an image message, we need to preserve the image data
-        if has_image and messages[message_index].get("image"):
-            # For image messages, we need to reconstruct the proper format
-            # The frontend stores the image as a data URL, but we need base64 for Ollama
-            image_data_url = messages[message_index]["image"]
-            
-            # Extract base64 data from data URL
-            if image_data_url.startswith('data:image'):
-                # Remove the data URL prefix to get just the base64 data
-                base64_data = image_data_url.split(',')[1]
-                
-                # Create the proper message format for llava
-                messages_for_api = [{
-                    "role": "user",
-                    "content": new_content,
-                    "images": [base64_data]
-                }]
-            else:
-                # If it's already base64 data (from old format), use it directly
-                base64_data = image_data_url
-                messages_for_api = [{
-                    "role": "user",
-                    "content": new_content,
-                    "images": [base64_data]
-                }]
+        # If it's an image message, send the stored image along with the edited prompt
+        image_id = user_message.get("imageId")
+        encoded_image = None
+        if has_image and image_id:
+            encoded_image = await asyncio.to_thread(image_store.model_image, image_id)
+
+        if encoded_image:
+            # Create the proper message format for llava
+            messages_for_api = [{
+                "role": "user",
+                "content": new_content,
+                "images": [encoded_image]
+            }]
         else:
-            # Fallback to regular text if image data is corrupted
+            # Fallback to regular text if the image is missing
             has_image = False
             model_to_use = MODEL_NAME
         
-        response = requests.post(OLLAMA_URL, json={
+        data = await ollama_chat({
             "model": model_to_use,
-            "messages": messages_for_api,
-            "stream": False
-        })
-        ai_reply = response.json()["message"]["content"] if response.ok else "❌ Error from LLM."
+            "messages": messages_for_api
+        }, priority=REGENERATION)
+        ai_reply = data["message"]["content"]
+    except LLMQueueFull:
+        return llm_busy_response()  # nothing saved yet, the edit can simply be retried
+    except aiohttp.ClientResponseError:
+        ai_reply = "❌ Error from LLM."
     except Exception as e:
         print(f"[ERROR] Error in edit_message: {e}")
         ai_reply = "⚠️ Unable to reach backend."
 
-    # Replace AI message or append if missing
-    if message_index + 1 < len(messages):
-        messages[message_index + 1]["content"] = ai_reply
-    else:
-        messages.append({"role": "assistant", "content": ai_reply})
-
-    save_conversations(convos)
-    return jsonify({
-        "content": ai_reply,
-        "conversation": convos[conversation_id]
+    # A new reply, without the old one's sources; a trailing user message gets its first reply
+    pair = [user_message, assistant_message(ai_reply, [])]
+    conversation_store.replace_messages_from(conversation_id, message_index, pair)
+    schedule_summary_update(conversation_id)
+    return jsonify({"content": ai_reply, "messages": pair, "messageStart": message_index})
+
+
+@app.route('/api/images/<image_id>', methods=['GET'])
+async def get_image(image_id):
+    if not image_store.is_image_id(image_id):
+        return jsonify({"error": "Invalid image id"}), 400
+
+    etag = f'"{image_id}"'
+    cache_control = f"public, max-age={IMAGE_CACHE_MAX_AGE}, immutable"
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+    data = await asyncio.to_thread(image_store.load_image, image_id)
+    if data is None:
+        return jsonify({"error": "Image not found"}), 404
+    return Response(data, mimetype=image_store.guess_mime(data), headers={
+        "ETag": etag,
+        "Cache-Control": cache_control,
     })
 
 
 @app.route('/api/chat-with-image', methods=['POST'])
-def chat_with_image():
-    print(f"[DEBUG] Image chat endpoint called")
-    print(f"[DEBUG] Request files: {list(request.files.keys())}")
-    print(f"[DEBUG] Request form: {list(request.form.keys())}")
-    
-    if 'image' not in request.files:
-        print(f"[ERROR] No image in request files")
+async def chat_with_image():
+    files = await request.files
+    form = await request.form
+
+    if 'image' not in files:
         return jsonify({'error': 'No image provided'}), 400
 
-    image_file = request.files['image']
-    prompt = request.form.get('prompt', '')  # Optional user message
-    conversation_id = request.form.get('conversationId')  # You need to send this from frontend
-    
-    print(f"[DEBUG] Image file: {image_file.filename}")
-    print(f"[DEBUG] Prompt: {prompt}")
-    print(f"[DEBUG] Conversation ID: {conversation_id}")
+    image_file = files['image']
+    prompt = form.get('prompt', '')  # Optional user message
+    conversation_id = form.get('conversationId')  # You need to send this from frontend
 
     if not conversation_id:
-        print(f"[ERROR] No conversation ID provided")
         return jsonify({"error": "No conversation ID provided"}), 400
     
     # Validate conversation ID format
     try:
         conversation_uuid = uuid.UUID(str(conversation_id))
         conversation_id = str(conversation_uuid)  # Ensure it's a string
-        print(f"[DEBUG] Validated conversation ID: {conversation_id}")
     except ValueError:
-        print(f"[ERROR] Invalid conversation ID format: {conversation_id}")
         return jsonify({"error": "Invalid conversation ID format"}), 400
 
-    # Read image and encode as base64
-    image_data = image_file.read()
-    encoded_image = base64.b64encode(image_data).decode("utf-8")
+    trace = metrics.start_trace("chat_with_image")
+
+    # Store the upload once; the model gets a downscaled JPEG of it
+    with metrics.span("image_preprocess"):
+        image_data = image_file.read()
+        image_id = await asyncio.to_thread(image_store.save_image, image_data)
+        encoded_image = await asyncio.to_thread(image_store.model_image, image_id)
 
     # Prepare messages for Ollama
     messages = [{
@@ -714,65 +1502,36 @@ def chat_with_image():
         "images": [encoded_image]
     }]
 
-    # Send to Ollama using synchronous requests
     try:
-        response = requests.post(OLLAMA_URL, json={
-            "model": "llava",  # Use a vision-capable model
-            "messages": messages,
-            "stream": False
-        }, timeout=60)
-        
-        if response.status_code == 200:
-            result = response.json()
-            print("LLM Response:", result)
-            reply = result.get("message", {}).get("content", "")
-
-            # Save conversation update here without touching the rest:
-            convos = load_conversations()
-            print(f"[DEBUG] Available conversations: {list(convos.keys())}")
-            print(f"[DEBUG] Looking for conversation: {conversation_id}")
-            print(f"[DEBUG] Conversation ID type: {type(conversation_id)}")
-            print(f"[DEBUG] Available conversation IDs types: {[type(k) for k in convos.keys()]}")
-            
-            # Try to find the conversation with different key types
-            found_conversation = None
-            for key in convos.keys():
-                if str(key) == str(conversation_id):
-                    found_conversation = key
-                    break
-            
-            if found_conversation is None:
-                print(f"[ERROR] Conversation {conversation_id} not found")
-                return jsonify({"error": "Conversation not found"}), 404
-            
-            conversation_id = found_conversation  # Use the actual key from the conversations dict
-
-            # Convert base64 to data URL format for frontend compatibility
-            data_url = f"data:image/jpeg;base64,{encoded_image}"
-            convos[conversation_id]["messages"].append({
-                "role": "user",
-                "content": prompt,
-                "image": data_url
-            })
-            convos[conversation_id]["messages"].append({
-                "role": "assistant",
-                "content": reply
+        with metrics.span("generation"):
+            result = await ollama_chat({
+                "model": "llava",  # Use a vision-capable model
+                "messages": messages
             })
+        reply = result.get("message", {}).get("content", "")
 
-            print(f"[DEBUG] Saving conversation with {len(convos[conversation_id]['messages'])} messages")
-            save_conversations(convos)
+        with metrics.span("conversation_save"):
+            saved = conversation_store.append_messages(conversation_id, [
+                {"role": "user", "content": prompt, "imageId": image_id},
+                {"role": "assistant", "content": reply},
+            ])
+        log_trace(trace)
 
-            print(f"[DEBUG] Successfully returning response: {reply[:100]}...")
-            print(f"[DEBUG] Response status: 200")
-            return jsonify({"content": reply})
-        else:
-            error = response.text
-            print(f"[ERROR] Ollama API error: {error}")
-            print(f"[ERROR] Response status: {response.status_code}")
-            return jsonify({"error": "Ollama API error", "details": error}), 500
+        if not saved:
+            return jsonify({"error": "Conversation not found"}), 404
+
+        return jsonify({"content": reply, "imageId": image_id})
+    except LLMQueueFull:
+        return llm_busy_response()
+    except aiohttp.ClientResponseError as e:
+        LLM_FAILURES.inc(call="vision")
+        print(f"[ERROR] Ollama API error {e.status}: {e.message}")
+        return jsonify({"error": "Ollama API error", "details": e.message}), 500
     except Exception as e:
-        print(f"[ERROR] Exception in image chat: {e}")
-        print(f"[ERROR] Exception type: {type(e)}")
+        if isinstance(e, asyncio.TimeoutError):
+            LLM_TIMEOUTS.inc(call="vision")
+        LLM_FAILURES.inc(call="vision")
+        print(f"[ERROR] Exception in image chat: {type(e).__name__}: {e}")
         import traceback
         print(f"[ERROR] Traceback: {traceback.format_exc()}")
         return jsonify({"error": "Error calling Ollama", "exception": str(e)}), 500
@@ -795,9 +1554,32 @@ def chat_with_image():
 
 
 # ========== START SERVER ==========
-# Start the background thread for preloading files
-file_cache_thread = threading.Thread(target=background_file_cache_refresher, args=(3600,), daemon=True)
-file_cache_thread.start()
+MODELS = (embedding_model, context_tokenizer, stt_backend)
+file_cache_thread = None
+
+
+def warm_models():
+    for model in MODELS:
+        model.warm()
+
+
+def start_index_worker():
+    # Started once the server is listening, so a restart does not wait for re-indexing
+    global file_cache_thread
+    if file_cache_thread is None:
+        if become_indexer():
+            target, args = background_file_cache_refresher, (FILE_REFRESH_INTERVAL, FILE_REFRESH_MODE == "watch")
+        else:
+            target, args = follow_published_index, (INDEX_FOLLOW_INTERVAL,)
+        file_cache_thread = threading.Thread(target=target, args=args, daemon=True)
+        file_cache_thread.start()
+
+
+if MODEL_LOADING == "eager":
+    for model in MODELS:
+        model.get()
 
+# Production: hypercorn app:app --bind 0.0.0.0:5000 --workers 4
+# (one worker indexes, the others map the index it publishes)
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,123 @@
+"""In-memory audio decoding and speech segmentation for speech-to-text.
+
+Uploaded clips (WebM/Opus from the browser, or anything ffmpeg understands)
+are decoded straight to the 16 kHz mono float32 array Whisper expects, without
+temp files. PyAV (``pip install av``, which bundles the ffmpeg libraries) decodes
+in-process, so a request never starts an ffmpeg process.
+
+``SpeechSegmenter`` splits a live PCM stream into utterances with a voice
+activity detector, for incremental transcription over a WebSocket.
+"""
+import io
+
+import av
+import numpy as np
+
+try:
+    import webrtcvad
+except ImportError:  # optional, the energy detector is used otherwise
+    webrtcvad = None
+
+SAMPLE_RATE = 16000
+
+
+def decode_audio(data, sample_rate=SAMPLE_RATE):
+    """Decode encoded audio ``data`` (bytes) to a mono float32 array in [-1, 1].
+
+    Raises ``ValueError`` if ``data`` is not audio PyAV can decode.
+    """
+    try:
+        return _decode_with_pyav(data, sample_rate)
+    except av.error.FFmpegError as e:
+        raise ValueError(f"Could not decode audio: {e}") from e
+
+
+def pcm16_to_float32(pcm):
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def _decode_with_pyav(data, sample_rate):
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=sample_rate)
+    chunks = []
+    with av.open(io.BytesIO(data)) as container:
+        for frame in container.decode(audio=0):
+            chunks.extend(out.to_ndarray().reshape(-1) for out in resampler.resample(frame))
+    chunks.extend(out.to_ndarray().reshape(-1) for out in resampler.resample(None))  # flush
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks).astype(np.float32) / 32768.0
+
+
+class SpeechSegmenter:
+    """Voice-activity segmentation of a live 16 kHz float32 stream.
+
+    ``feed`` returns events for the caller to transcribe:
+
+    - ``("partial", audio)`` every ``partial_every_ms`` of new speech, with the
+      current utterance so far;
+    - ``("segment", audio)`` once ``end_silence_ms`` of silence (or
+      ``max_segment_s`` of speech) ends an utterance.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_ms=30, energy_threshold=0.01,
+                 end_silence_ms=600, partial_every_ms=1000, pre_roll_ms=300, max_segment_s=25):
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_len = sample_rate * frame_ms // 1000
+        self.energy_threshold = energy_threshold
+        self.end_silence_ms = end_silence_ms
+        self.partial_every_ms = partial_every_ms
+        self.pre_roll_frames = pre_roll_ms // frame_ms
+        self.max_segment_frames = max_segment_s * 1000 // frame_ms
+        self.vad = webrtcvad.Vad(2) if webrtcvad is not None else None
+
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._pre_roll = []
+        self._segment = []  # frames of the current utterance, empty when not in speech
+        self._silence_ms = 0
+        self._since_partial_ms = 0
+
+    def is_speech(self, frame):
+        if self.vad is not None:
+            pcm = (np.clip(frame, -1, 1) * 32767).astype(np.int16).tobytes()
+            return self.vad.is_speech(pcm, self.sample_rate)
+        return float(np.sqrt(np.mean(frame ** 2))) >= self.energy_threshold
+
+    def feed(self, audio):
+        events = []
+        audio = np.concatenate([self._pending, audio])
+        usable = len(audio) - len(audio) % self.frame_len
+        self._pending = audio[usable:]
+
+        for start in range(0, usable, self.frame_len):
+            frame = audio[start:start + self.frame_len]
+            speech = self.is_speech(frame)
+
+            if not self._segment:
+                if speech:
+                    self._segment = self._pre_roll + [frame]
+                    self._pre_roll = []
+                    self._silence_ms = 0
+                    self._since_partial_ms = 0
+                else:
+                    self._pre_roll = (self._pre_roll + [frame])[-self.pre_roll_frames:]
+                continue
+
+            self._segment.append(frame)
+            self._silence_ms = 0 if speech else self._silence_ms + self.frame_ms
+            self._since_partial_ms += self.frame_ms
+
+            if self._silence_ms >= self.end_silence_ms or len(self._segment) >= self.max_segment_frames:
+                events.append(("segment", np.concatenate(self._segment)))
+                self._segment = []
+            elif self._since_partial_ms >= self.partial_every_ms:
+                events.append(("partial", np.concatenate(self._segment)))
+                self._since_partial_ms = 0
+        return events
+
+    def flush(self):
+        """End of stream: return the unfinished utterance, if any, as a final segment."""
+        frames = self._segment + ([self._pending] if self._segment and len(self._pending) else [])
+        self._segment = []
+        self._pending = np.zeros(0, dtype=np.float32)
+        return [("segment", np.concatenate(frames))] if frames else []
@@ -0,0 +1,126 @@
+"""Benchmark the document embedding pipeline.
+
+Compares the old per-file ``encode(..., convert_to_tensor=True)`` loop with the
+corpus-wide batched pipeline, reporting chunks/sec, resident memory and the
+size of the stored vectors. Each variant runs in a fresh interpreter so its
+memory is not inflated by the other one's model and tensors.
+
+    python bench_embeddings.py --folder files --backend onnx-int8 --dtype int8
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import extractors
+from chunking import chunk_document, chunk_text
+from embeddings import encode_corpus, load_embedding_model
+from vector_index import VectorIndex
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def rss_mb():
+    """Current (not peak) resident memory of this process."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    with open("/proc/self/statm") as f:  # Linux without psutil; second field is resident pages
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def load_corpus(folder, model):
+    """Structured chunks per file, plus how many chunks the old 100-word windows gave."""
+    def count(text):
+        return len(model.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    corpus = {}
+    word_window_chunks = 0
+    for file_path in sorted(Path(folder).glob("*")):
+        if file_path.suffix.lower() in (".pdf", ".docx", ".xlsx", ".txt"):
+            blocks = extractors.extract_blocks(file_path)
+            word_window_chunks += len(chunk_text(extractors.blocks_to_text(blocks)))
+            chunks = chunk_document(blocks, count, model.max_seq_length - 2)
+            corpus[str(file_path)] = [chunk["text"] for chunk in chunks]
+    return corpus, word_window_chunks
+
+
+def bench_per_file(model, corpus):
+    start = time.perf_counter()
+    vectors = [model.encode(chunks, convert_to_tensor=True) for chunks in corpus.values() if chunks]
+    elapsed = time.perf_counter() - start
+    return elapsed, sum(v.element_size() * v.nelement() for v in vectors)
+
+
+def bench_batched(model, corpus, batch_size, dtype):
+    start = time.perf_counter()
+    all_chunks = [chunk for chunks in corpus.values() for chunk in chunks]
+    embeddings = encode_corpus(model, all_chunks, batch_size)
+    elapsed = time.perf_counter() - start
+
+    index = VectorIndex(embeddings.shape[1], dtype)
+    files, offset = {}, 0
+    for path, chunks in corpus.items():
+        files[path] = (chunks, [{"offset": i} for i in range(len(chunks))], embeddings[offset:offset + len(chunks)])
+        offset += len(chunks)
+    index.update(files)
+    return elapsed, index.nbytes()
+
+
+def child(variant, args):
+    if variant == "before":
+        model = load_embedding_model(args.model, "torch")
+    else:
+        model = load_embedding_model(args.model, args.backend, args.threads)
+    model_rss = rss_mb()
+    corpus, word_window_chunks = load_corpus(args.folder, model)
+    if variant == "before":
+        elapsed, nbytes = bench_per_file(model, corpus)
+    else:
+        encode_corpus(model, ["warm up"], args.batch_size)
+        elapsed, nbytes = bench_batched(model, corpus, args.batch_size, args.dtype)
+    print(json.dumps({"files": len(corpus), "chunks": sum(len(chunks) for chunks in corpus.values()),
+                      "word_window_chunks": word_window_chunks, "seconds": elapsed, "vector_bytes": nbytes,
+                      "model_rss_mb": model_rss, "rss_mb": rss_mb()}))
+
+
+def run(variant):
+    output = subprocess.run([sys.executable, __file__, *sys.argv[1:], "--child", variant], check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--folder", default="files")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16", "int8"])
+    parser.add_argument("--child", choices=["before", "after"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args)
+        return
+
+    before = run("before")
+    n = before["chunks"]
+    print(f"{before['files']} files, {n} chunks ({before['word_window_chunks']} with 100-word windows)")
+    print(f"before  per-file torch float32 tensors:  {n / before['seconds']:8.1f} chunks/s  "
+          f"vectors {before['vector_bytes'] / 2**20:7.2f} MB  rss {before['rss_mb']:7.1f} MB "
+          f"(model loaded: {before['model_rss_mb']:.1f} MB)")
+
+    after = run("after")
+    print(f"after   batched {args.backend} bs={args.batch_size} threads={args.threads} {args.dtype}:  "
+          f"{n / after['seconds']:8.1f} chunks/s  vectors {after['vector_bytes'] / 2**20:7.2f} MB  "
+          f"rss {after['rss_mb']:7.1f} MB (model loaded: {after['model_rss_mb']:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Load test for the chat endpoints against a stubbed Ollama.
+
+Starts a fake Ollama on ``--stub-port`` that answers every chat call after
+``--latency`` seconds, then fires ``--requests`` chats at the backend with
+``--concurrency`` in flight and reports requests/sec and latency percentiles.
+Start the backend pointed at the stub first:
+
+    OLLAMA_URL=http://127.0.0.1:11435/api/chat hypercorn app:app --bind 127.0.0.1:5000
+    python bench_load.py --concurrency 16 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+from aiohttp import web
+
+STUB_REPLY = "This is a stubbed reply from the load-test Ollama server."
+STUB_MCP_REPLY = {"search_needed": False, "search_query": None, "assistant_reply": STUB_REPLY}
+
+
+def make_stub(latency):
+    async def chat(request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        content = json.dumps(STUB_MCP_REPLY) if body.get("format") else STUB_REPLY
+        if not body.get("stream"):
+            return web.json_response({"message": {"role": "assistant", "content": content}, "done": True})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        for word in content.split(" "):
+            chunk = {"message": {"role": "assistant", "content": word + " "}, "done": False}
+            await response.write((json.dumps(chunk) + "\n").encode())
+        await response.write((json.dumps({"message": {"content": ""}, "done": True}) + "\n").encode())
+        return response
+
+    async def tags(request):
+        return web.json_response({"models": [{"name": "mistral"}, {"name": "llava"}]})
+
+    app = web.Application()
+    app.router.add_post("/api/chat", chat)
+    app.router.add_get("/api/tags", tags)
+    return app
+
+
+async def run_load(target, total, concurrency, question, stream):
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{target}/api/conversations") as resp:
+            conversation_id = (await resp.json())["id"]
+
+        latencies = []
+        errors = 0
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with session.post(f"{target}/api/chat", json={
+                        "conversationId": conversation_id,
+                        "messages": [{"role": "user", "content": question}],
+                        "stream": stream,
+                    }) as resp:
+                        await resp.read()
+                        if resp.status != 200:
+                            errors += 1
+                            return
+                except aiohttp.ClientError:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+        async with session.delete(f"{target}/api/conversations/{conversation_id}"):
+            pass
+    return latencies, errors, elapsed
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", default="http://127.0.0.1:5000")
+    parser.add_argument("--stub-port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.5, help="stub seconds per Ollama call")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--question", default="What does the VESG-2 document say about maintenance?")
+    parser.add_argument("--stream", action="store_true")
+    args = parser.parse_args()
+
+    runner = web.AppRunner(make_stub(args.latency))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.stub_port).start()
+    try:
+        latencies, errors, elapsed = await run_load(args.target, args.requests, args.concurrency, args.question, args.stream)
+    finally:
+        await runner.cleanup()
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, stub latency {args.latency}s")
+    print(f"  throughput: {len(latencies) / elapsed:.1f} req/s  errors: {errors}")
+    print(f"  latency p50: {percentile(latencies, 0.5) * 1000:.0f} ms  "
+          f"p95: {percentile(latencies, 0.95) * 1000:.0f} ms  max: {max(latencies, default=0) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""Benchmark backend startup: time to import app.py and time until every model is ready.
+
+Each run imports app.py in a fresh interpreter with the given MODEL_LOADING
+mode ("eager" is the old load-everything-at-import behaviour), then warms and
+waits for the models, reporting seconds and resident memory at both points.
+
+    python bench_startup.py --modes eager background --runs 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from bench_embeddings import rss_mb
+
+
+def child():
+    started = time.perf_counter()
+    import app
+    result = {"import_seconds": time.perf_counter() - started, "import_rss_mb": rss_mb()}
+    app.warm_models()
+    for model in app.MODELS:
+        model.get()
+    result["ready_seconds"] = time.perf_counter() - started
+    result["ready_rss_mb"] = rss_mb()
+    result["load_seconds"] = {model.name: model.load_seconds for model in app.MODELS}
+    print(json.dumps(result))
+
+
+def run(mode):
+    env = {**os.environ, "MODEL_LOADING": mode}
+    output = subprocess.run([sys.executable, __file__, "--child"], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=["eager", "background", "lazy"],
+                        choices=["eager", "background", "lazy"])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    for mode in args.modes:
+        results = [run(mode) for _ in range(args.runs)]
+        median = lambda key: statistics.median(r[key] for r in results)
+        loads = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in results[-1]["load_seconds"].items())
+        print(f"{mode:10}  import {median('import_seconds'):6.2f}s  rss {median('import_rss_mb'):7.1f} MB   "
+              f"models ready {median('ready_seconds'):6.2f}s  rss {median('ready_rss_mb'):7.1f} MB   ({loads})")
+
+
+if __name__ == "__main__":
+    main()
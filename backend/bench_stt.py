@@ -0,0 +1,67 @@
+"""Benchmark speech-to-text on CPU: real-time factor and throughput.
+
+Transcribes each clip once on its own (real-time factor = processing time /
+audio duration), then submits ``--concurrency`` copies of every clip to the
+STT worker at once to measure batched throughput.
+
+    python bench_stt.py --backend faster-whisper --model-size small clip1.webm clip2.wav
+"""
+import argparse
+import time
+from concurrent.futures import wait
+
+import numpy as np
+
+from audio import SAMPLE_RATE, decode_audio
+from stt_worker import STTWorker, load_stt_backend
+
+
+def load_clips(paths, synthetic_seconds):
+    if not paths:
+        # Noise only measures speed, not accuracy; pass real recordings for that
+        rng = np.random.default_rng(0)
+        return {"synthetic": (rng.standard_normal(synthetic_seconds * SAMPLE_RATE) * 0.05).astype(np.float32)}
+    clips = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            clips[path] = decode_audio(f.read())
+    return clips
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("clips", nargs="*", help="audio files (any format PyAV can decode)")
+    parser.add_argument("--backend", default="openai-whisper", choices=["openai-whisper", "faster-whisper"])
+    parser.add_argument("--model-size", default="small")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--synthetic-seconds", type=int, default=8)
+    args = parser.parse_args()
+
+    clips = load_clips(args.clips, args.synthetic_seconds)
+
+    started = time.perf_counter()
+    backend = load_stt_backend(args.backend, args.model_size)
+    print(f"{args.backend} {args.model_size}: model loaded in {time.perf_counter() - started:.1f}s")
+    backend.transcribe(next(iter(clips.values()))[:SAMPLE_RATE])  # warm up
+
+    for name, audio in clips.items():
+        duration = len(audio) / SAMPLE_RATE
+        started = time.perf_counter()
+        text = backend.transcribe(audio)
+        elapsed = time.perf_counter() - started
+        print(f"  {name}: {duration:.1f}s audio in {elapsed:.2f}s, RTF {elapsed / duration:.3f}  {text[:60]!r}")
+
+    worker = STTWorker(backend, max_queue=args.concurrency * len(clips), max_batch=args.max_batch).start()
+    started = time.perf_counter()
+    futures = [worker.submit(audio) for _ in range(args.concurrency) for audio in clips.values()]
+    wait(futures)
+    elapsed = time.perf_counter() - started
+    audio_seconds = worker.stats["audio_seconds"]
+    print(f"worker, {len(futures)} clips submitted together (max batch {args.max_batch}): "
+          f"{len(futures) / elapsed:.2f} clips/s, {audio_seconds / elapsed:.1f}s audio per second, "
+          f"RTF {worker.real_time_factor():.3f}, {worker.stats['batches']} batches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Persistent BM25 inverted index over the same chunks as the vector index.
+
+Exact terms such as reference codes and names are often missed by embeddings
+but are matched directly here. Postings map each term to ``{doc: tf}`` so a
+query only touches the documents containing its terms. ``reciprocal_rank_fusion``
+merges these hits with the semantic ones.
+"""
+import heapq
+import json
+import math
+import os
+import re
+import unicodedata
+from threading import Lock
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60  # damping of reciprocal rank fusion; 60 is the usual default
+
+BM25_FILE = "bm25.json"
+
+# Codes like "VESG-2" or "12.5/A" are kept whole and also split into their parts
+_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+_STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+au aux avec ce ces dans de des du elle en est et il ils la le les leur mais ne ou par pas pour qu que qui
+sa se ses son sont sur un une
+""".split())
+
+
+def tokenize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))  # fold accents: "é" -> "e"
+    tokens = []
+    for match in _TOKEN_RE.findall(text):
+        parts = re.split(r"[-./]", match)
+        if len(parts) > 1:
+            tokens.append(match)
+        tokens.extend(p for p in parts if p and p not in _STOPWORDS)
+    return tokens
+
+
+def _term_counts(text):
+    counts = {}
+    for token in tokenize(text):
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+class BM25Index:
+    """Chunk-level BM25 with per-file incremental updates (same shape as ``VectorIndex``)."""
+
+    def __init__(self):
+        self.version = 0
+        self._lock = Lock()
+        self._docs = []  # [path, meta, chunk, length] or None for a freed slot
+        self._free = []
+        self._by_path = {}  # path -> doc ids
+        self._postings = {}  # term -> {doc id: term frequency}
+        self._total_length = 0
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._by_path.values())
+
+    def paths(self):
+        return set(self._by_path)
+
+    def chunks_for(self, path):
+        with self._lock:
+            return [self._docs[i][2] for i in self._by_path.get(path, [])]
+
+    def update(self, files, removed=()):
+        """Replace the chunks of ``files`` (path -> ``(chunks, metas)``) and drop ``removed`` paths."""
+        with self._lock:
+            for path in set(files) | set(removed):
+                self._remove_path(path)
+            for path, (chunks, metas) in files.items():
+                ids = [self._add_doc(path, meta, chunk) for chunk, meta in zip(chunks, metas)]
+                if ids:
+                    self._by_path[path] = ids
+            self.version += 1
+
+    def _add_doc(self, path, meta, chunk):
+        counts = _term_counts(chunk)
+        length = sum(counts.values())
+        doc = [path, meta, chunk, length]
+        if self._free:
+            doc_id = self._free.pop()
+            self._docs[doc_id] = doc
+        else:
+            doc_id = len(self._docs)
+            self._docs.append(doc)
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+        self._total_length += length
+        return doc_id
+
+    def _remove_path(self, path):
+        for doc_id in self._by_path.pop(path, []):
+            _, _, chunk, length = self._docs[doc_id]
+            for term in _term_counts(chunk):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self._postings[term]
+            self._total_length -= length
+            self._docs[doc_id] = None
+            self._free.append(doc_id)
+
+    def search(self, query, top_k=10):
+        """Return the ``top_k`` chunks for ``query`` as dicts with score, chunk, path and their metadata."""
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._docs) - len(self._free)
+            if n == 0 or not terms:
+                return []
+            avg_length = self._total_length / n
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    length = self._docs[doc_id][3]
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+            top = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            docs = [(score, self._docs[doc_id]) for doc_id, score in top]
+        return [{"score": score, "chunk": chunk, "path": path, **meta} for score, (path, meta, chunk, _) in docs]
+
+    # ========== PERSISTENCE ==========
+
+    def save(self, directory):
+        """Write the index atomically; postings are saved so loading does not re-tokenize."""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            # Renumber live documents densely so freed slots are not persisted
+            live = [i for i, doc in enumerate(self._docs) if doc is not None]
+            new_id = {old: new for new, old in enumerate(live)}
+            data = {
+                "docs": [self._docs[i] for i in live],
+                "postings": {
+                    term: [[new_id[d], tf] for d, tf in postings.items()]
+                    for term, postings in self._postings.items()
+                },
+            }
+        path = os.path.join(directory, BM25_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, directory):
+        """Load a saved index, or return an empty one if none exists or it is unusable."""
+        index = cls()
+        try:
+            with open(os.path.join(directory, BM25_FILE), "r", encoding="utf-8") as f:
+                data = json.load(f)
+            index._docs = data["docs"]
+            index._postings = {term: dict(map(tuple, postings)) for term, postings in data["postings"].items()}
+        except FileNotFoundError:
+            return index
+        except Exception as e:
+            print(f"[Index] Could not load BM25 index from {directory}: {e}")
+            return cls()
+
+        for doc_id, (path, _, _, length) in enumerate(index._docs):
+            index._by_path.setdefault(path, []).append(doc_id)
+            index._total_length += length
+        print(f"[Index] Loaded BM25 index of {len(index._docs)} chunks from {directory}")
+        return index
+
+
+def reciprocal_rank_fusion(*rankings, k=RRF_K):
+    """Fuse ranked hit lists by ``sum(1 / (k + rank))`` over the lists each chunk appears in.
+
+    Hits are identified by ``(path, offset)``; the first list's dict is kept for
+    a chunk found in several lists. Returns ``[(fused_score, hit)]`` best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            key = (hit["path"], hit["offset"])
+            score, first = fused.get(key, (0.0, hit))
+            fused[key] = (score + 1.0 / (k + rank), first)
+    return sorted(fused.values(), key=lambda item: item[0], reverse=True)
@@ -0,0 +1,129 @@
+"""Small in-process caches."""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire ``ttl`` seconds after being set."""
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._data),
+        }
+
+
+class SemanticCache:
+    """Answers keyed by question embedding, so near-duplicate questions reuse them.
+
+    An entry is only returned for the same ``model`` and the same set of
+    ``chunk_ids`` (the chunks the question retrieves), and only if the cosine
+    similarity of the (normalized) embeddings is at least ``threshold``.
+    Entries expire after ``ttl`` seconds and the least recently used are
+    evicted beyond ``maxsize``; ``invalidate`` drops those citing changed files.
+    """
+
+    def __init__(self, threshold=0.95, maxsize=512, ttl=86400):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self._data = OrderedDict()  # (model, chunk_ids, question) -> (expires_at, embedding, value, seconds)
+        self._lock = Lock()
+
+    def get(self, embedding, model, chunk_ids):
+        """Return the value of the most similar matching entry, or None."""
+        chunk_ids = frozenset(chunk_ids)
+        now = time.monotonic()
+        with self._lock:
+            best, best_score = None, self.threshold
+            for key, (expires_at, cached, _, _) in list(self._data.items()):
+                if expires_at < now:
+                    del self._data[key]
+                    continue
+                if key[0] != model or key[1] != chunk_ids:
+                    continue
+                score = float(cached @ embedding)
+                if score >= best_score:
+                    best, best_score = key, score
+            if best is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(best)
+            _, _, value, seconds = self._data[best]
+            self.hits += 1
+            self.seconds_saved += seconds
+            return value
+
+    def set(self, question, embedding, model, chunk_ids, value, seconds=0.0):
+        """Store ``value``; ``seconds`` is what producing it cost, counted as saved on each hit."""
+        key = (model, frozenset(chunk_ids), question)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, embedding, value, seconds)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, paths):
+        """Drop entries whose chunk ids ``(path, offset)`` come from any of ``paths``."""
+        paths = set(paths)
+        with self._lock:
+            for key in [key for key in self._data if any(path in paths for path, _ in key[1])]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "seconds_saved": self.seconds_saved,
+            "size": len(self._data),
+        }
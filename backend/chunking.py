@@ -0,0 +1,154 @@
+"""Chunking of extracted documents for embedding.
+
+``StructuredChunker`` is what the index uses: it packs whole sentences and
+table rows into token-bounded chunks that carry their page and section.
+``chunk_text`` is the older fixed word-window chunker, kept for comparison
+in bench_embeddings.py.
+"""
+import re
+
+from extractors import HEADING, TEXT
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+(?=\S)")
+
+
+def split_sentences(text):
+    return [s for s in _SENTENCE_END_RE.split(" ".join(text.split())) if s]
+
+
+class StructuredChunker:
+    """Token-bounded chunks over ``(page, kind, text)`` blocks, fed in document order.
+
+    Sentences and table rows are packed whole into chunks of at most
+    ``max_tokens`` (as counted by ``count``, normally the embedding model's
+    tokenizer); consecutive chunks repeat up to ``overlap_tokens`` of trailing
+    sentences. A heading always starts a new chunk and becomes the ``section``
+    of the chunks that follow it. Each chunk is a dict with ``offset`` (word
+    offset in the document), ``text``, ``page``, ``page_end`` and ``section``.
+    """
+
+    def __init__(self, count, max_tokens=254, overlap_tokens=32):
+        self.count = count
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.section = None
+        self.units = []  # (offset, words, tokens, page) of the open chunk
+        self.tokens = 0
+        self.fresh = 0  # units not yet emitted in any chunk
+        self.offset = 0  # words seen so far
+
+    def feed(self, blocks):
+        chunks = []
+        for page, kind, text in blocks:
+            if kind == HEADING:
+                chunks.extend(self._flush(overlap=False))
+                self.section = " ".join(text.split())
+            units = split_sentences(text) if kind == TEXT else [" ".join(text.split())]
+            for unit in units:
+                for piece in self._split_long(unit):
+                    chunks.extend(self._add(piece, page))
+        return chunks
+
+    def close(self):
+        return self._flush(overlap=False)
+
+    def _add(self, text, page):
+        chunks = []
+        tokens = self.count(text)
+        if self.units and self.tokens + tokens > self.max_tokens:
+            chunks.extend(self._flush(overlap=True))
+            if self.tokens + tokens > self.max_tokens:
+                self.units, self.tokens = [], 0  # no room for the overlap next to this unit
+        words = text.split()
+        self.units.append((self.offset, words, tokens, page))
+        self.tokens += tokens
+        self.fresh += 1
+        self.offset += len(words)
+        return chunks
+
+    def _split_long(self, text):
+        """Split a sentence longer than ``max_tokens`` into word runs that fit."""
+        tokens = self.count(text)
+        if tokens <= self.max_tokens:
+            return [text]
+        words = text.split()
+        if len(words) == 1:
+            return [text]  # nothing to split on; the embedder truncates it
+        size = max(1, len(words) * self.max_tokens // tokens)
+        pieces = []
+        for i in range(0, len(words), size):
+            pieces.extend(self._split_long(" ".join(words[i:i + size])))
+        return pieces
+
+    def _flush(self, overlap):
+        chunks = []
+        if self.fresh:
+            pages = [u[3] for u in self.units if u[3] is not None]
+            chunks.append({
+                "offset": self.units[0][0],
+                "text": " ".join(word for u in self.units for word in u[1]),
+                "page": min(pages) if pages else None,
+                "page_end": max(pages) if pages else None,
+                "section": self.section,
+            })
+        kept = []
+        if overlap:
+            tokens = 0
+            for unit in reversed(self.units):
+                if tokens + unit[2] > self.overlap_tokens:
+                    break
+                kept.insert(0, unit)
+                tokens += unit[2]
+        self.units = kept
+        self.tokens = sum(u[2] for u in kept)
+        self.fresh = 0
+        return chunks
+
+
+def chunk_document(blocks, count, max_tokens=254, overlap_tokens=32):
+    chunker = StructuredChunker(count, max_tokens, overlap_tokens)
+    return chunker.feed(blocks) + chunker.close()
+
+
+class StreamingChunker:
+    """Overlapping word windows over text that arrives piece by piece (e.g. PDF pages).
+
+    Feeding pages one at a time yields the same ``(word_offset, chunk)`` pairs as
+    chunking the joined text, while only holding one window of words.
+    """
+
+    def __init__(self, max_length=100, overlap=20):
+        self.max_length = max_length
+        self.step = max_length - overlap
+        self.words = []
+        self.base = 0  # global offset of self.words[0]
+
+    def feed(self, text):
+        self.words.extend(text.split())
+        chunks = []
+        while len(self.words) >= self.max_length:
+            chunks.append((self.base, " ".join(self.words[:self.max_length])))
+            del self.words[:self.step]
+            self.base += self.step
+        return chunks
+
+    def close(self):
+        chunks = []
+        while self.words:
+            chunks.append((self.base, " ".join(self.words[:self.max_length])))
+            if len(self.words) <= self.step:
+                break
+            del self.words[:self.step]
+            self.base += self.step
+        self.words = []
+        return chunks
+
+
+def chunk_text_with_offsets(text, max_length=100, overlap=20):
+    """Split ``text`` into overlapping word windows, returning ``(word_offset, chunk)`` pairs."""
+    chunker = StreamingChunker(max_length, overlap)
+    return chunker.feed(text) + chunker.close()
+
+
+def chunk_text(text, max_length=100, overlap=20):
+    return [chunk for _, chunk in chunk_text_with_offsets(text, max_length, overlap)]
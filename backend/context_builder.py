@@ -0,0 +1,142 @@
+"""Token-budgeted prompt assembly for multi-turn chat.
+
+A prompt is packed in priority order into a fixed budget: the current
+question, the system instructions and retrieved context, a rolling summary of
+older turns, then as many recent turns as still fit (newest first). Token
+counts come from the Mistral tokenizer when the ``tokenizers`` package can
+load it, and from a conservative character estimate otherwise.
+"""
+import math
+import os
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # optional, the character estimate is used otherwise
+    Tokenizer = None
+
+MESSAGE_OVERHEAD = 4  # [INST]/[/INST] and role markers around each message
+CHARS_PER_TOKEN = 3.0  # SentencePiece averages ~3.5-4 chars per token on English/French prose
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+def load_token_counter(name_or_path):
+    """Return ``count(text) -> int`` for the model's tokenizer, or an estimate if it is unavailable.
+
+    ``name_or_path`` is a tokenizer.json file; anything else is looked up on
+    the Hugging Face hub, which needs network access (and a token for gated
+    repos).
+    """
+    if Tokenizer is None:
+        reason = "the tokenizers package is not installed"
+    elif name_or_path.endswith(".json") and not os.path.exists(name_or_path):
+        reason = f"{name_or_path} does not exist"
+    else:
+        try:
+            if os.path.exists(name_or_path):
+                tokenizer = Tokenizer.from_file(name_or_path)
+            else:
+                tokenizer = Tokenizer.from_pretrained(name_or_path)
+        except Exception as e:
+            reason = f"could not load tokenizer {name_or_path}: {e}"
+        else:
+            print(f"[Context] Counting tokens with {name_or_path}")
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+    # Loaded once per process (app.py keeps the counter in a LazyResource), so this is logged once
+    print(f"[Context] Estimating token counts from characters, prompts may overflow the context window: {reason}")
+    return estimate_tokens
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def message_tokens(message, count):
+    return count(message.get("content") or "") + MESSAGE_OVERHEAD
+
+
+def truncate_to_tokens(text, max_tokens, count):
+    """Longest prefix of ``text`` that fits in ``max_tokens``."""
+    if max_tokens <= 0:
+        return ""
+    if count(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+
+def pack_prompt(prompt, history, summary, budget, count, system_share=0.6):
+    """Fit ``prompt`` plus conversation memory into ``budget`` tokens.
+
+    ``prompt`` is the single-turn prompt (system messages followed by the user
+    question). System messages may use up to ``system_share`` of what is left
+    after the question; the longest ones are cut first. The summary and then
+    ``history`` (oldest first; only text turns are sent) fill the remainder.
+    """
+    *system, question = prompt
+    question = dict(question)
+    remaining = budget - MESSAGE_OVERHEAD
+    question["content"] = truncate_to_tokens(question["content"], remaining // 2, count)
+    remaining -= count(question["content"])
+
+    system = [dict(m) for m in system]
+    system_budget = int(remaining * system_share)
+    sizes = [message_tokens(m, count) for m in system]
+    while sum(sizes) > system_budget and system:
+        i = max(range(len(system)), key=sizes.__getitem__)
+        excess = sum(sizes) - system_budget
+        system[i]["content"] = truncate_to_tokens(system[i]["content"], sizes[i] - MESSAGE_OVERHEAD - excess, count)
+        sizes[i] = message_tokens(system[i], count)
+        if not system[i]["content"]:
+            del system[i], sizes[i]
+    remaining -= sum(sizes)
+
+    memory = []
+    if summary:
+        summary_message = {"role": "system", "content": SUMMARY_PREFIX + summary}
+        size = message_tokens(summary_message, count)
+        if size <= remaining:
+            memory.append(summary_message)
+            remaining -= size
+
+    recent = []
+    for message in reversed(history):
+        turn = {"role": message["role"], "content": message.get("content") or ""}
+        size = message_tokens(turn, count)
+        if size > remaining:
+            break
+        recent.append(turn)
+        remaining -= size
+    recent.reverse()
+
+    return system + memory + recent + [question]
+
+
+def summary_prompt(summary, messages, budget, count):
+    """Messages asking the model to fold ``messages`` into the running ``summary``."""
+    lines = []
+    for message in messages:
+        role = "User" if message["role"] == "user" else "Assistant"
+        lines.append(f"{role}: {message.get('content') or ''}")
+    transcript = truncate_to_tokens("\n".join(lines), budget - count(summary or ""), count)
+    return [
+        {
+            "role": "system",
+            "content": (
+                "You maintain a running summary of a conversation between a user and an assistant. "
+                "Rewrite the summary so it also covers the new turns. Keep names, numbers, document "
+                "references and open questions; drop greetings and filler. Answer with the summary only, "
+                "in at most 150 words."
+            ),
+        },
+        {
+            "role": "user",
+            "content": f"Current summary:\n{summary or '(none yet)'}\n\nNew turns:\n{transcript}",
+        },
+    ]
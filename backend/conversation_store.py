@@ -0,0 +1,281 @@
+"""SQLite-backed conversation storage.
+
+Conversations live in a WAL-mode SQLite database with one row per message, so
+appending a turn writes only the new rows instead of rewriting the history of
+every conversation ever stored.
+"""
+import json
+import os
+import sqlite3
+import time
+from threading import Lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL DEFAULT 'Untitled',
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL DEFAULT '',
+    extra TEXT,
+    PRIMARY KEY (conversation_id, idx)
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    conversation_id TEXT PRIMARY KEY REFERENCES conversations(id) ON DELETE CASCADE,
+    summary TEXT NOT NULL,
+    covered INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_by_updated ON conversations (updated_at DESC, id DESC);
+"""
+
+_conn = None
+_lock = Lock()
+
+
+def init_store(db_path, legacy_json=None, save_image=None, decode_image=None):
+    """Open (or create) the database and import ``legacy_json`` once if it exists.
+
+    ``save_image``/``decode_image`` are passed on to ``migrate_from_json``.
+    """
+    global _conn
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.executescript(SCHEMA)
+    with _lock:
+        _conn = conn
+    if legacy_json and os.path.exists(legacy_json):
+        migrate_from_json(legacy_json, save_image, decode_image)
+
+
+def migrate_from_json(path, save_image=None, decode_image=None):
+    """One-time import of the old whole-file ``conversations.json`` store.
+
+    The import only runs against an empty database; afterwards the JSON file is
+    renamed to ``<path>.migrated`` so it is never imported twice. The emptiness
+    check runs inside the write transaction, so when several workers start at
+    once only the first imports and the others find the database populated.
+
+    Images the old store kept inline as data URLs are moved to the image store
+    during the import: ``decode_image(str) -> bytes | None`` parses the old
+    value and ``save_image(bytes) -> id`` stores it, and the message keeps
+    ``imageId`` in place of ``image``.
+    """
+    with _lock:
+        _conn.execute("BEGIN IMMEDIATE")
+        try:
+            if _conn.execute("SELECT 1 FROM conversations LIMIT 1").fetchone():
+                _conn.execute("ROLLBACK")
+                print(f"[Store] Skipping migration of {path}: database already populated")
+                return 0
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+            except FileNotFoundError:
+                _conn.execute("ROLLBACK")
+                return 0  # another worker migrated and renamed it
+            except Exception as e:
+                _conn.execute("ROLLBACK")
+                print(f"[Store] Could not read {path} for migration: {e}")
+                return 0
+
+            now = time.time()
+            images = 0
+            for cid, convo in data.items():
+                messages = convo.get("messages", [])
+                if save_image is not None:
+                    messages = [_store_inline_image(m, save_image, decode_image) for m in messages]
+                    images += sum("imageId" in m for m in messages)
+                _conn.execute(
+                    "INSERT INTO conversations (id, title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, ?)",
+                    (str(cid), convo.get("title", "Untitled"), now, now, len(messages)),
+                )
+                _conn.executemany(
+                    "INSERT INTO messages (conversation_id, idx, role, content, extra) VALUES (?, ?, ?, ?, ?)",
+                    [_message_row(str(cid), i, m) for i, m in enumerate(messages)],
+                )
+            _conn.execute("COMMIT")
+        except Exception:
+            _conn.execute("ROLLBACK")
+            raise
+
+    try:
+        os.replace(path, path + ".migrated")
+    except FileNotFoundError:
+        pass  # an empty legacy file can be "imported" by two workers; one renames it
+    print(f"[Store] Migrated {len(data)} conversations ({images} images) from {path}")
+    return len(data)
+
+
+def _store_inline_image(message, save_image, decode):
+    value = message.get("image")
+    data = decode(value) if isinstance(value, str) else None
+    if not data:
+        return message
+    message = {k: v for k, v in message.items() if k != "image"}
+    message["imageId"] = save_image(data)
+    return message
+
+
+def _message_row(cid, idx, message):
+    extra = {k: v for k, v in message.items() if k not in ("role", "content")}
+    return (cid, idx, message.get("role", "user"), message.get("content") or "", json.dumps(extra) if extra else None)
+
+
+def _row_to_message(row):
+    message = {"role": row["role"], "content": row["content"]}
+    if row["extra"]:
+        message.update(json.loads(row["extra"]))
+    return message
+
+
+# ========== READS ==========
+
+def list_conversation_summaries(limit=50, cursor=None):
+    """Most recently updated conversations first, without message bodies.
+
+    ``cursor`` is the ``(updated_at, id)`` of the last row of the previous page.
+    Returns ``(summaries, next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    query = "SELECT id, title, updated_at, message_count FROM conversations"
+    params = []
+    if cursor is not None:
+        query += " WHERE (updated_at, id) < (?, ?)"
+        params += list(cursor)
+    query += " ORDER BY updated_at DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+    with _lock:
+        rows = [dict(r) for r in _conn.execute(query, params)]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, (rows[-1]["updated_at"], rows[-1]["id"])
+
+
+def get_conversation_meta(cid):
+    with _lock:
+        row = _conn.execute("SELECT * FROM conversations WHERE id = ?", (cid,)).fetchone()
+    return dict(row) if row else None
+
+
+def conversation_exists(cid):
+    return get_conversation_meta(cid) is not None
+
+
+def get_messages_page(cid, before=None, limit=50):
+    """Up to ``limit`` messages with index < ``before`` (default: the latest ones), oldest first.
+
+    Returns ``(messages, start)`` where ``start`` is the index of the first message returned.
+    """
+    with _lock:
+        if before is None:
+            rows = _conn.execute(
+                "SELECT * FROM messages WHERE conversation_id = ? ORDER BY idx DESC LIMIT ?", (cid, limit)
+            ).fetchall()
+        else:
+            rows = _conn.execute(
+                "SELECT * FROM messages WHERE conversation_id = ? AND idx < ? ORDER BY idx DESC LIMIT ?",
+                (cid, before, limit),
+            ).fetchall()
+    rows.reverse()
+    start = rows[0]["idx"] if rows else 0
+    return [_row_to_message(r) for r in rows], start
+
+
+def get_summary(cid):
+    """Return ``(summary, covered)``: the rolling summary of messages ``[0, covered)``."""
+    with _lock:
+        row = _conn.execute("SELECT summary, covered FROM summaries WHERE conversation_id = ?", (cid,)).fetchone()
+    return (row["summary"], row["covered"]) if row else ("", 0)
+
+
+# ========== WRITES ==========
+
+def set_summary(cid, summary, covered, expected_covered=None):
+    """Store the rolling summary, unless it changed since ``expected_covered`` was read."""
+    with _lock:
+        _conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = _conn.execute("SELECT covered FROM summaries WHERE conversation_id = ?", (cid,)).fetchone()
+            if expected_covered is not None and (row["covered"] if row else 0) != expected_covered:
+                _conn.execute("ROLLBACK")
+                return False
+            _conn.execute(
+                "INSERT OR REPLACE INTO summaries (conversation_id, summary, covered) "
+                "SELECT id, ?, ? FROM conversations WHERE id = ?",
+                (summary, covered, cid),
+            )
+            _conn.execute("COMMIT")
+        except Exception:
+            _conn.execute("ROLLBACK")
+            raise
+    return True
+
+
+def create_conversation(cid, title="Untitled"):
+    now = time.time()
+    with _lock:
+        _conn.execute(
+            "INSERT INTO conversations (id, title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, 0)",
+            (cid, title, now, now),
+        )
+
+
+def delete_conversation(cid):
+    with _lock:
+        cur = _conn.execute("DELETE FROM conversations WHERE id = ?", (cid,))
+    return cur.rowcount > 0
+
+
+def set_title(cid, title):
+    with _lock:
+        cur = _conn.execute("UPDATE conversations SET title = ?, updated_at = ? WHERE id = ?", (title, time.time(), cid))
+    return cur.rowcount > 0
+
+
+def append_messages(cid, messages):
+    """Append ``messages`` to the end of a conversation. Returns False if it does not exist."""
+    return replace_messages_from(cid, None, messages)
+
+
+def replace_messages_from(cid, start, messages):
+    """Drop every message at index >= ``start`` and append ``messages`` in their place.
+
+    ``start=None`` appends after the current last message.
+    """
+    with _lock:
+        _conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = _conn.execute("SELECT message_count FROM conversations WHERE id = ?", (cid,)).fetchone()
+            if row is None:
+                _conn.execute("ROLLBACK")
+                return False
+            count = row["message_count"]
+            if start is None or start > count:
+                start = count
+            if start < count:
+                _conn.execute("DELETE FROM messages WHERE conversation_id = ? AND idx >= ?", (cid, start))
+                # A summary that covered rewritten messages no longer matches the history
+                _conn.execute("DELETE FROM summaries WHERE conversation_id = ? AND covered > ?", (cid, start))
+            _conn.executemany(
+                "INSERT INTO messages (conversation_id, idx, role, content, extra) VALUES (?, ?, ?, ?, ?)",
+                [_message_row(cid, start + i, m) for i, m in enumerate(messages)],
+            )
+            _conn.execute(
+                "UPDATE conversations SET message_count = ?, updated_at = ? WHERE id = ?",
+                (start + len(messages), time.time(), cid),
+            )
+            _conn.execute("COMMIT")
+        except Exception:
+            _conn.execute("ROLLBACK")
+            raise
+    return True
@@ -0,0 +1,48 @@
+"""Loading and batched inference for the sentence embedding model."""
+import numpy as np
+
+# int8-quantized ONNX export shipped in the all-MiniLM-L6-v2 repository (runs on any AVX2 CPU)
+ONNX_INT8_FILE = "onnx/model_quint8_avx2.onnx"
+
+
+def load_embedding_model(name, backend="torch", threads=None):
+    """Load ``name`` with the ``"torch"``, ``"onnx"`` or ``"onnx-int8"`` inference backend.
+
+    The ONNX backends need sentence-transformers >= 3.2 with onnxruntime; if
+    they cannot be loaded the regular torch model is used instead.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+    if backend in ("onnx", "onnx-int8"):
+        model_kwargs = {"file_name": ONNX_INT8_FILE} if backend == "onnx-int8" else {}
+        if threads:
+            try:
+                import onnxruntime
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = threads
+                model_kwargs["session_options"] = options
+            except ImportError:
+                pass
+        try:
+            return SentenceTransformer(name, backend="onnx", model_kwargs=model_kwargs)
+        except Exception as e:
+            print(f"[Embeddings] Could not load {name} with backend {backend}, using torch: {e}")
+
+    return SentenceTransformer(name)
+
+
+def encode_corpus(model, texts, batch_size=64):
+    """Encode ``texts`` in one batched pass into normalized float32 vectors."""
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    return model.encode(
+        texts,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    ).astype(np.float32, copy=False)
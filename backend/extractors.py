@@ -0,0 +1,183 @@
+"""Text extraction for the documents in FILE_FOLDER.
+
+Kept separate from app.py so extraction can run in worker processes that only
+import this module and not the models. PyPDF2, python-docx and openpyxl are
+imported by the function that needs them, so importing app.py does not pay
+for them until a document is indexed.
+
+Documents are returned as lists of ``Block(page, kind, text)``: headings,
+paragraphs of running text, and table rows rendered as ``header: value``
+pairs. ``page`` is 1-based for PDFs and None for other formats.
+"""
+import re
+from collections import namedtuple
+from pathlib import Path
+
+Block = namedtuple("Block", ["page", "kind", "text"])
+HEADING, TEXT, ROW = "heading", "text", "row"
+
+# "2.1 Scope", "IV. Results", "Article 3 - ...": a number or keyword followed by a capitalized word
+_NUMBERED_HEADING_RE = re.compile(
+    r"^(\d+(\.\d+)*\.?|[IVXLC]+\.|(Chapitre|Chapter|Article|Section|Annexe|Annex|Titre|Partie|Part)\s+[\dIVXLC]+\W*)\s+(?=[^\W\d_])"
+)
+
+
+def _clean_pdf_page(raw):
+    # Normalize spacing and fix broken lines
+    raw = re.sub(r'(?<!\.)\s+$', '', raw.strip())  # remove trailing space
+    raw = re.sub(r'(\w+)-\n(\w+)', r'\1\2', raw)  # fix hyphenated words split across lines
+    raw = re.sub(r'([a-zA-Z])- ([a-zA-Z])', r'\1\2', raw)  # fix word breaks
+    return raw
+
+
+def looks_like_heading(line):
+    """Short line that is numbered ("2.1 Scope", "Article 3") or written in capitals."""
+    words = line.split()
+    if not words or len(words) > 10 or len(line) > 100 or line[-1] in ".,;":
+        return False
+    match = _NUMBERED_HEADING_RE.match(line)
+    if match:
+        # "1 Pump A 200 kW" is a table row, not a heading
+        rest = line[match.end():]
+        return rest[0].isupper() and not any(c.isdigit() for c in rest)
+    letters = [c for c in line if c.isalpha()]
+    return len(letters) >= 4 and all(c.isupper() for c in letters)
+
+
+def _text_blocks(lines, page=None):
+    """Group lines into paragraphs, with heading lines as blocks of their own."""
+    blocks = []
+    paragraph = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if looks_like_heading(line):
+            if paragraph:
+                blocks.append(Block(page, TEXT, " ".join(paragraph)))
+                paragraph = []
+            blocks.append(Block(page, HEADING, line))
+        else:
+            paragraph.append(line)
+    if paragraph:
+        blocks.append(Block(page, TEXT, " ".join(paragraph)))
+    return blocks
+
+
+def _table_rows(rows):
+    """``header: value`` rows for a table whose first non-empty row holds the column names."""
+    blocks = []
+    header = None
+    for row in rows:
+        cells = ["" if cell is None else " ".join(str(cell).split()) for cell in row]
+        if not any(cells):
+            continue
+        if header is None:
+            header = [name or f"Column {i + 1}" for i, name in enumerate(cells)]
+            continue
+        pairs = [f"{header[i] if i < len(header) else f'Column {i + 1}'}: {cell}" for i, cell in enumerate(cells) if cell]
+        blocks.append(Block(None, ROW, "; ".join(pairs)))
+    if header is not None and not blocks:
+        blocks.append(Block(None, ROW, "; ".join(name for name in header)))  # a header-only table
+    return blocks
+
+
+def blocks_to_text(blocks):
+    return "\n".join(block[2] for block in blocks)
+
+
+def pdf_page_count(path):
+    import PyPDF2
+    with open(path, "rb") as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def extract_blocks_from_pdf(path, start=0, end=None):
+    """Return the blocks of pages ``start:end``."""
+    import PyPDF2
+    blocks = []
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        pages = reader.pages
+        for i in range(start, len(pages) if end is None else min(end, len(pages))):
+            raw = pages[i].extract_text()
+            if raw:
+                blocks.extend(_text_blocks(_clean_pdf_page(raw).split("\n"), page=i + 1))
+    return blocks
+
+
+def _docx_body(doc):
+    # Paragraphs and tables in document order (python-docx >= 1.0), else tables after the text
+    if hasattr(doc, "iter_inner_content"):
+        return list(doc.iter_inner_content())
+    return list(doc.paragraphs) + list(doc.tables)
+
+
+def extract_blocks_from_docx(path):
+    import docx
+    blocks = []
+    doc = docx.Document(path)
+    for item in _docx_body(doc):
+        if isinstance(item, docx.table.Table):
+            blocks.extend(_table_rows([cell.text for cell in row.cells] for row in item.rows))
+            continue
+        text = " ".join(item.text.split())
+        if not text:
+            continue
+        style = (item.style.name if item.style is not None else "").lower()
+        is_heading = style.startswith(("heading", "title", "titre"))
+        blocks.append(Block(None, HEADING if is_heading else TEXT, text))
+    return blocks
+
+
+def extract_blocks_from_xlsx(path):
+    import openpyxl
+    blocks = []
+    wb = openpyxl.load_workbook(path, data_only=True, read_only=True)
+    for sheet in wb.worksheets:
+        rows = _table_rows(sheet.iter_rows(values_only=True))
+        if rows:
+            blocks.append(Block(None, HEADING, sheet.title))
+            blocks.extend(rows)
+    return blocks
+
+
+def extract_blocks_from_txt(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return _text_blocks(f.read().split("\n"))
+
+
+def extract_blocks(file_path):
+    ext = Path(file_path).suffix.lower()
+    if ext == ".pdf":
+        return extract_blocks_from_pdf(file_path)
+    elif ext == ".docx":
+        return extract_blocks_from_docx(file_path)
+    elif ext == ".xlsx":
+        return extract_blocks_from_xlsx(file_path)
+    elif ext == ".txt":
+        return extract_blocks_from_txt(file_path)
+    raise ValueError(f"Unsupported file type: {ext}")
+
+
+def extract_part(file_path, start=None, end=None):
+    """Worker task: the blocks of a PDF page range, or of a whole other document.
+
+    Unreadable files raise rather than return no blocks, so they are not
+    recorded as indexed.
+    """
+    if start is not None:
+        return extract_blocks_from_pdf(file_path, start, end)
+    return extract_blocks(file_path)
+
+
+def plan_parts(file_path, pages_per_part):
+    """Split a file into ``(start, end)`` extraction tasks; only PDFs are split."""
+    if Path(file_path).suffix.lower() != ".pdf":
+        return [(None, None)]
+    try:
+        count = pdf_page_count(file_path)
+    except Exception as e:
+        print(f"PDF extraction error for {file_path}: {e}")
+        return [(None, None)]
+    return [(i, i + pages_per_part) for i in range(0, max(count, 1), pages_per_part)]
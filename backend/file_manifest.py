@@ -0,0 +1,103 @@
+"""Manifest of indexed documents for incremental re-indexing.
+
+Each indexed file is recorded by path with its mtime, size and SHA-256, so a
+refresh only re-extracts and re-embeds files that were added, changed or
+deleted. A restart does not re-extract unchanged files either: their chunks
+are already in the saved indexes.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # optional, only needed for FILE_REFRESH_MODE = "watch"
+    Observer = None
+    FileSystemEventHandler = object
+
+MANIFEST_FILE = "manifest.json"
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(directory):
+    """Return the saved entries, or an empty manifest if there are none."""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"[Manifest] Could not load manifest from {directory}: {e}")
+        return {}
+
+
+def save_manifest(directory, entries):
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, MANIFEST_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entries, f)
+    os.replace(tmp, os.path.join(directory, MANIFEST_FILE))
+
+
+def scan_folder(folder, entries, extensions):
+    """Compare ``folder`` against the manifest ``entries``.
+
+    Returns ``(changed, removed, new_entries)``. mtime and size are checked
+    first; the content hash is only computed when they differ, so a touched
+    but unmodified file is not reported as changed.
+    """
+    changed = []
+    new_entries = {}
+    for file_path in Path(folder).glob("*"):
+        if file_path.suffix.lower() not in extensions or not file_path.is_file():
+            continue
+        path = str(file_path)
+        try:
+            st = file_path.stat()
+            old = entries.get(path)
+            if old and old["mtime"] == st.st_mtime and old["size"] == st.st_size:
+                new_entries[path] = old
+                continue
+            sha = file_sha256(file_path)
+        except OSError as e:
+            print(f"[Manifest] Could not read {path}: {e}")
+            continue
+        new_entries[path] = {"mtime": st.st_mtime, "size": st.st_size, "sha256": sha}
+        if not old or old["sha256"] != sha:
+            changed.append(path)
+
+    removed = [path for path in entries if path not in new_entries]
+    return changed, removed, new_entries
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    def __init__(self, on_change):
+        self.on_change = on_change
+
+    def on_any_event(self, event):
+        if not event.is_directory:
+            self.on_change()
+
+
+def start_watcher(folder, on_change):
+    """Call ``on_change()`` whenever something in ``folder`` changes (inotify on Linux).
+
+    Returns the running observer, or None if watchdog is not installed.
+    """
+    if Observer is None:
+        print("[Manifest] watchdog is not installed, falling back to polling")
+        return None
+    observer = Observer()
+    observer.schedule(_ChangeHandler(on_change), str(folder), recursive=False)
+    observer.daemon = True
+    observer.start()
+    return observer
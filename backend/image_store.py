@@ -0,0 +1,129 @@
+"""Content-addressed storage for uploaded images.
+
+Each upload is written once to ``<root>/<id[:2]>/<id>``, where the id is the
+SHA-256 of its bytes, and messages reference it by that id instead of carrying
+a base64 data URL. The smaller JPEG sent to the vision model is derived on
+first use and kept next to the original.
+"""
+import base64
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional, images go to the model as uploaded otherwise
+    Image = ImageOps = None
+
+MODEL_MAX_SIDE = 1024  # llava works on 336-672 px tiles; larger only costs upload and decode time
+MODEL_JPEG_QUALITY = 85
+MODEL_SUFFIX = ".model.jpg"
+
+_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+_MIME_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+]
+
+_root = "images"
+
+
+def init_image_store(root):
+    global _root
+    _root = root
+    os.makedirs(root, exist_ok=True)
+
+
+def is_image_id(value):
+    return isinstance(value, str) and bool(_ID_RE.match(value))
+
+
+def image_path(image_id, suffix=""):
+    return os.path.join(_root, image_id[:2], image_id + suffix)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def save_image(data):
+    """Store ``data`` (bytes) unless an identical image is already stored; return its id."""
+    image_id = hashlib.sha256(data).hexdigest()
+    path = image_path(image_id)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    return image_id
+
+
+def load_image(image_id):
+    if not is_image_id(image_id):
+        return None
+    try:
+        with open(image_path(image_id), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def guess_mime(data):
+    for signature, mime in _MIME_SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def downscale(data, max_side=MODEL_MAX_SIDE, quality=MODEL_JPEG_QUALITY):
+    """Fit ``data`` within ``max_side`` pixels and re-encode as JPEG (needs Pillow)."""
+    if Image is None:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft("RGB", (max_side, max_side))  # JPEG decodes at a reduced scale directly
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            resized = max(img.size) > max_side
+            img.thumbnail((max_side, max_side))
+            out = io.BytesIO()
+            img.save(out, "JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        print(f"[Images] Could not downscale image, sending it as uploaded: {e}")
+        return data
+    out = out.getvalue()
+    # A small PNG or an already-compressed JPEG can come out larger
+    return out if resized or len(out) < len(data) else data
+
+
+def model_image(image_id):
+    """Return the base64 payload for the vision model, or None if the image is unknown."""
+    cached = image_path(image_id, MODEL_SUFFIX)
+    if is_image_id(image_id) and os.path.exists(cached):
+        with open(cached, "rb") as f:
+            return base64.b64encode(f.read()).decode("ascii")
+
+    data = load_image(image_id)
+    if data is None:
+        return None
+    prepared = downscale(data)
+    if Image is not None:
+        _write_atomic(cached, prepared)
+    return base64.b64encode(prepared).decode("ascii")
+
+
+def decode_data_url(value):
+    """Bytes of a ``data:image/...;base64,`` URL or bare base64 string, or None."""
+    if value.startswith("data:"):
+        value = value.split(",", 1)[-1]
+    try:
+        return base64.b64decode(value, validate=True)
+    except ValueError:
+        return None
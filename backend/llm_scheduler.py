@@ -0,0 +1,104 @@
+"""Priority scheduling and admission control for calls to Ollama.
+
+Each model has its own concurrency limit (a chat model and a vision model do
+not share slots) and its own queue of waiting calls, served by priority class
+and then in arrival order. When a model's queue is full, new calls fail fast
+with ``LLMQueueFull`` so the route can answer 429 instead of piling more work
+onto Ollama. Lower priority classes may only fill half of the queue, so
+background work never crowds out interactive requests.
+
+All methods must be called from the event loop thread.
+"""
+import asyncio
+import heapq
+import itertools
+import random
+from collections import Counter
+
+INTERACTIVE, REGENERATION, BACKGROUND = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", REGENERATION: "regeneration", BACKGROUND: "background"}
+
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_CAP = 8.0
+
+
+class LLMQueueFull(Exception):
+    """Raised when a model's wait queue is at capacity."""
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Full-jitter exponential backoff for retry ``attempt`` (0-based): uniform in ``[0, min(cap, base * 2**attempt)]``."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class _ModelQueue:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiting = 0
+        self.waiters = []  # heap of (priority, seq, future); cancelled futures are skipped on pop
+
+
+class LLMScheduler:
+    """Per-model concurrency limits with priority queues in front of them."""
+
+    def __init__(self, limits, default_limit=2, max_queue=32):
+        self.limits = dict(limits)
+        self.default_limit = default_limit
+        self.max_queue = max_queue
+        self.rejected = Counter()  # (model, priority name) -> calls refused
+        self._models = {}
+        self._seq = itertools.count()
+
+    def _queue(self, model):
+        queue = self._models.get(model)
+        if queue is None:
+            queue = self._models[model] = _ModelQueue(self.limits.get(model, self.default_limit))
+        return queue
+
+    def check_admission(self, model, priority=INTERACTIVE):
+        """Raise ``LLMQueueFull`` now if a call to ``model`` would have to wait and the queue is full."""
+        queue = self._queue(model)
+        if queue.in_flight < queue.limit and not queue.waiting:
+            return
+        capacity = self.max_queue if priority == INTERACTIVE else self.max_queue // 2
+        if queue.waiting >= capacity:
+            self.rejected[(model, PRIORITY_NAMES[priority])] += 1
+            raise LLMQueueFull(f"{queue.waiting} calls to {model} are already waiting")
+
+    async def acquire(self, model, priority=INTERACTIVE):
+        """Wait for a slot for ``model``; every successful acquire needs a ``release``."""
+        queue = self._queue(model)
+        if queue.in_flight < queue.limit and not queue.waiting:
+            queue.in_flight += 1
+            return
+        self.check_admission(model, priority)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(queue.waiters, (priority, next(self._seq), future))
+        queue.waiting += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                queue.waiting -= 1
+            else:
+                self.release(model)  # the slot was handed over just as the caller was cancelled
+            raise
+
+    def release(self, model):
+        """Hand the slot to the best waiting call, or free it."""
+        queue = self._models[model]
+        while queue.waiters:
+            _, _, future = heapq.heappop(queue.waiters)
+            if not future.done():
+                queue.waiting -= 1
+                future.set_result(None)
+                return
+        queue.in_flight -= 1
+
+    def stats(self):
+        return {
+            model: {"limit": queue.limit, "in_flight": queue.in_flight, "waiting": queue.waiting}
+            for model, queue in self._models.items()
+        }
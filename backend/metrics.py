@@ -0,0 +1,184 @@
+"""Prometheus-style metrics and per-request stage traces.
+
+Counters and histograms live in process and are rendered in the Prometheus
+text exposition format by ``render()`` (served at ``GET /metrics``). Gauges
+are read from a callback at scrape time.
+
+``span(stage)`` times a block into the ``lpee_stage_seconds`` histogram and,
+when a trace was started for the current request, also appends
+``(stage, seconds)`` to it. Traces follow ``asyncio.to_thread`` calls because
+the thread runs in a copy of the caller's context.
+"""
+import bisect
+import contextvars
+import json
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+# Seconds; spans range from sub-millisecond lookups to minute-long generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels: ``inc(1, call="mcp")``."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in sorted(values.items())]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with ``_bucket``, ``_sum`` and ``_count`` series per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label values -> [bucket counts..., sum]
+        self._lock = Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[i] += 1
+            entry[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(entry) for key, entry in self._values.items()}
+        samples = []
+        for key, entry in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), entry):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                samples.append((self.name + "_bucket", labels, cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((self.name + "_sum", labels, entry[-1]))
+            samples.append((self.name + "_count", labels, cumulative))
+        return samples
+
+
+class Gauge:
+    """Value read at scrape time from ``fn``, which returns a number or ``{label values: number}``."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, fn, labelnames=(), kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind  # "counter" for totals kept elsewhere, e.g. cache hits
+        _registry.append(self)
+
+    def samples(self):
+        value = self.fn()
+        if not isinstance(value, dict):
+            return [(self.name, "", value)]
+        return [(self.name, _format_labels(self.labelnames, key), v) for key, v in sorted(value.items())]
+
+
+def render():
+    """All registered metrics in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for metric in _registry:
+        try:
+            samples = metric.samples()
+        except Exception as e:
+            print(f"[Metrics] Could not collect {metric.name}: {e}")
+            continue
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+# ========== STAGE SPANS ==========
+
+STAGE_SECONDS = Histogram("lpee_stage_seconds", "Time spent in each stage of a request.", ["stage"])
+
+
+class Trace:
+    """Stages of one request in the order they finished."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def to_json(self):
+        return json.dumps({
+            "request": self.name,
+            "seconds": round(self.elapsed(), 4),
+            "spans": [[stage, round(seconds, 4)] for stage, seconds in self.spans],
+        })
+
+
+def start_trace(name):
+    trace = Trace(name)
+    _current_trace.set(trace)
+    return trace
+
+
+@contextmanager
+def span(stage, trace=None):
+    """Time the enclosed block as ``stage``; recorded even if it raises."""
+    trace = trace or _current_trace.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        if trace is not None:
+            trace.spans.append((stage, seconds))
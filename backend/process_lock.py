@@ -0,0 +1,26 @@
+"""Exclusive cross-process lock on a file, used to elect the one worker that indexes.
+
+The lock is held for as long as the returned file stays open and is released
+by the operating system when the process exits, so a crashed indexer never
+leaves a stale lock behind.
+"""
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def try_lock(path):
+    """Lock ``path`` without waiting; returns the open file (keep a reference) or None if taken."""
+    f = open(path, "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        return None
+    return f
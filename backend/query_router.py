@@ -0,0 +1,88 @@
+"""Local routing of chat messages without an LLM call.
+
+Decides whether a message needs document retrieval from the embedding model
+that is already loaded for search: the similarity of the best document chunk,
+plus the similarity to a small set of intent prototypes. Only ambiguous
+messages are left to the MCP routing call.
+"""
+from collections import Counter
+from threading import Lock
+
+import numpy as np
+
+ROUTE_SEARCH = "search"
+ROUTE_CHAT = "chat"
+ROUTE_MCP = "mcp"
+
+INTENT_PROTOTYPES = {
+    ROUTE_CHAT: [
+        "hello, how are you?",
+        "what is your name?",
+        "who are you and what can you do?",
+        "tell me a joke",
+        "thanks for your help",
+        "good night, see you later",
+        "can you help me write an email?",
+        "what do you think about life?",
+    ],
+    ROUTE_SEARCH: [
+        "what does the document say about this?",
+        "give me the details of this item",
+        "find information about this person in the files",
+        "what is the value of this parameter in the report?",
+        "according to the specification, what are the requirements?",
+        "which code or reference number corresponds to this?",
+        "summarize the section about this topic",
+        "what are the test results for this sample?",
+    ],
+}
+
+# Cosine similarity thresholds for all-MiniLM-L6-v2
+SEARCH_SCORE = 0.5  # a chunk this close is worth retrieving regardless of intent
+MIN_SEARCH_SCORE = 0.3  # below this the corpus has nothing relevant
+INTENT_MARGIN = 0.1  # how much closer one intent must be than the other
+
+
+class QueryRouter:
+    """Route a message to retrieval, plain chat, or the MCP fallback."""
+
+    def __init__(self, encode):
+        self.encode = encode
+        self.counts = Counter()
+        self._prototypes = None
+        self._lock = Lock()
+
+    def _intent_scores(self, query_embedding):
+        if self._prototypes is None:
+            self._prototypes = {
+                intent: np.stack([self.encode(text) for text in texts])
+                for intent, texts in INTENT_PROTOTYPES.items()
+            }
+        return {intent: float(np.max(vectors @ query_embedding)) for intent, vectors in self._prototypes.items()}
+
+    def route(self, query, best_chunk_score):
+        """Return ``(route, details)`` for ``query`` given the best chunk similarity."""
+        intents = self._intent_scores(self.encode(query))
+        chat_lead = intents[ROUTE_CHAT] - intents[ROUTE_SEARCH]
+
+        if best_chunk_score >= SEARCH_SCORE:
+            route = ROUTE_SEARCH
+        elif best_chunk_score < MIN_SEARCH_SCORE and chat_lead >= INTENT_MARGIN:
+            route = ROUTE_CHAT
+        elif best_chunk_score >= MIN_SEARCH_SCORE and -chat_lead >= INTENT_MARGIN:
+            route = ROUTE_SEARCH
+        else:
+            route = ROUTE_MCP
+
+        with self._lock:
+            self.counts[route] += 1
+        return route, {"best_chunk_score": best_chunk_score, **intents}
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        return {
+            "routes": counts,
+            "local_rate": (total - counts.get(ROUTE_MCP, 0)) / total if total else 0.0,
+        }
@@ -0,0 +1,63 @@
+"""Slow-to-load resources (models, tokenizers) behind a readiness flag.
+
+A ``LazyResource`` is loaded by the first ``get()`` or ahead of time by
+``warm()`` on a background thread, so importing app.py stays fast and a
+worker only loads what it uses. ``status()`` is what ``/api/health`` reports.
+"""
+import threading
+import time
+
+NOT_LOADED, LOADING, READY, FAILED = "not_loaded", "loading", "ready", "failed"
+
+
+class LazyResource:
+    """Value produced once by ``loader()``; concurrent ``get()`` calls wait for the same load."""
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.state = NOT_LOADED
+        self.load_seconds = None
+        self.error = None
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.state == READY:
+            return self._value
+        with self._lock:
+            if self.state != READY:
+                self.state = LOADING
+                started = time.perf_counter()
+                try:
+                    self._value = self.loader()
+                except Exception as e:
+                    self.state, self.error = FAILED, str(e)
+                    print(f"[Startup] Loading {self.name} failed: {e}")
+                    raise  # the next get() tries again
+                self.load_seconds = time.perf_counter() - started
+                self.state, self.error = READY, None
+                print(f"[Startup] Loaded {self.name} in {self.load_seconds:.1f}s")
+        return self._value
+
+    def warm(self):
+        """Start loading on a daemon thread unless it is already loaded or loading."""
+        if self.state in (NOT_LOADED, FAILED):
+            threading.Thread(target=self._warm, name=f"warm-{self.name}", daemon=True).start()
+
+    def _warm(self):
+        try:
+            self.get()
+        except Exception:
+            pass  # recorded in state/error for /api/health
+
+    def ready(self):
+        return self.state == READY
+
+    def status(self):
+        status = {"state": self.state}
+        if self.load_seconds is not None:
+            status["load_seconds"] = round(self.load_seconds, 2)
+        if self.error is not None:
+            status["error"] = self.error
+        return status
@@ -0,0 +1,106 @@
+"""Assembly of retrieved chunks into one deduplicated, budgeted context block.
+
+Chunks overlap by design (word windows with overlap), so hits from the same
+file whose word ranges touch are first merged into a single passage. Passages
+are then picked by maximal marginal relevance, which skips near-duplicates
+from different files, until the token budget is spent.
+"""
+import os
+
+import numpy as np
+
+from context_builder import truncate_to_tokens
+
+MMR_LAMBDA = 0.7  # relevance vs. novelty; 1.0 is plain ranking by score
+NEAR_DUPLICATE = 0.95  # passages this similar to one already picked are dropped
+
+
+def merge_overlapping(hits):
+    """Merge hits from the same file whose ``[offset, offset + words)`` ranges overlap or touch."""
+    by_path = {}
+    for hit in hits:
+        by_path.setdefault(hit["path"], []).append(hit)
+
+    passages = []
+    for path, file_hits in by_path.items():
+        file_hits.sort(key=lambda h: h["offset"])
+        current = None
+        for hit in file_hits:
+            words = hit["chunk"].split()
+            end = hit["offset"] + len(words)
+            if current is not None and hit["offset"] <= current["end"]:
+                current["words"].extend(words[current["end"] - hit["offset"]:])
+                current["end"] = max(current["end"], end)
+                current["score"] = max(current["score"], hit["score"])
+                current["embeddings"].append(hit["embedding"])
+                current["pages"].extend(p for p in (hit.get("page"), hit.get("page_end")) if p is not None)
+                continue
+            current = {
+                "path": path,
+                "offset": hit["offset"],
+                "end": end,
+                "words": list(words),
+                "score": hit["score"],
+                "embeddings": [hit["embedding"]],
+                "pages": [p for p in (hit.get("page"), hit.get("page_end")) if p is not None],
+                "section": hit.get("section"),
+            }
+            passages.append(current)
+
+    for passage in passages:
+        passage["text"] = " ".join(passage.pop("words"))
+        pages = passage.pop("pages")
+        passage["page"] = min(pages) if pages else None
+        passage["page_end"] = max(pages) if pages else None
+        embedding = np.mean(passage.pop("embeddings"), axis=0)
+        passage["embedding"] = embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+    return passages
+
+
+def select_passages(passages, budget, count, mmr_lambda=MMR_LAMBDA):
+    """Pick passages by MMR until ``budget`` tokens are used; returns them in selection order."""
+    remaining = list(passages)
+    selected = []
+    used = 0
+    while remaining:
+        def mmr(passage):
+            redundancy = max((float(passage["embedding"] @ s["embedding"]) for s in selected), default=0.0)
+            return mmr_lambda * passage["score"] - (1 - mmr_lambda) * redundancy, redundancy
+
+        best = max(remaining, key=lambda p: mmr(p)[0])
+        remaining.remove(best)
+        if mmr(best)[1] >= NEAR_DUPLICATE or any(best["text"] in s["text"] for s in selected):
+            continue
+        size = count(best["text"])
+        if used + size > budget:
+            if selected:
+                continue  # a shorter passage further down may still fit
+            # The best passage alone is over budget: keep its beginning
+            best = {**best, "text": truncate_to_tokens(best["text"], budget, count)}
+            size = count(best["text"])
+        selected.append(best)
+        used += size
+    return selected
+
+
+def passage_sources(passages):
+    """Distinct ``{file, page, page_end, section}`` citations for ``passages``, in order."""
+    sources = []
+    for passage in passages:
+        source = {
+            "file": os.path.basename(passage["path"]),
+            "page": passage["page"],
+            "page_end": passage["page_end"],
+            "section": passage["section"],
+        }
+        if source not in sources:
+            sources.append(source)
+    return sources
+
+
+def assemble_context(hits, budget, count):
+    """Return ``(context, sources)`` for ``hits`` within ``budget`` tokens; context is None if nothing matched."""
+    passages = select_passages(merge_overlapping(hits), budget, count)
+    if not passages:
+        return None, []
+    return "\n\n".join(f"...{passage['text']}..." for passage in passages), passage_sources(passages)
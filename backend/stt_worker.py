@@ -0,0 +1,156 @@
+"""Dedicated speech-to-text worker.
+
+Requests hand decoded 16 kHz audio to a single worker thread through a bounded
+queue instead of running Whisper on the request thread. Clips queued close
+together are batched: short clips (up to Whisper's 30 s window) are decoded
+in one forward pass, longer ones are transcribed on their own. The model is
+pluggable between openai-whisper and faster-whisper (CTranslate2, int8 on CPU)
+and may be passed as a ``LazyResource``, in which case it is loaded on the
+worker thread when the first clip arrives (or earlier if warmed).
+"""
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from resources import LazyResource
+
+SAMPLE_RATE = 16000
+MAX_BATCH_SAMPLES = 30 * SAMPLE_RATE  # Whisper's fixed input window
+
+_Job = namedtuple("_Job", ["audio", "future"])
+
+
+class STTQueueFull(Exception):
+    """Raised by ``STTWorker.submit`` when the queue is at capacity."""
+
+
+class OpenAIWhisperBackend:
+    name = "openai-whisper"
+
+    def __init__(self, model_size="small", device="cpu"):
+        import whisper
+        self.whisper = whisper
+        self.model = whisper.load_model(model_size, device=device)
+
+    def transcribe(self, audio):
+        return self.model.transcribe(audio, fp16=False)["text"].strip()
+
+    def transcribe_batch(self, audios):
+        import torch
+        whisper = self.whisper
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(audio)), n_mels=self.model.dims.n_mels)
+            for audio in audios
+        ]).to(self.model.device)
+        options = whisper.DecodingOptions(fp16=False, without_timestamps=True)
+        return [result.text.strip() for result in whisper.decode(self.model, mels, options)]
+
+
+class FasterWhisperBackend:
+    name = "faster-whisper"
+
+    def __init__(self, model_size="small", device="cpu", compute_type="int8", cpu_threads=0):
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(model_size, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+
+    def transcribe(self, audio):
+        segments, _ = self.model.transcribe(audio, beam_size=1, vad_filter=True)
+        return "".join(segment.text for segment in segments).strip()
+
+    def transcribe_batch(self, audios):
+        # CTranslate2 is already fast per clip; run the batch back to back
+        return [self.transcribe(audio) for audio in audios]
+
+
+def load_stt_backend(name="openai-whisper", model_size="small", **kwargs):
+    if name == "faster-whisper":
+        return FasterWhisperBackend(model_size, **kwargs)
+    if name == "openai-whisper":
+        return OpenAIWhisperBackend(model_size, **kwargs)
+    raise ValueError(f"Unknown STT backend: {name}")
+
+
+class STTWorker:
+    """Single thread that owns the STT model and serves a bounded queue of clips."""
+
+    def __init__(self, backend, max_queue=16, max_batch=8, batch_window=0.05):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.stats = {"clips": 0, "batches": 0, "rejected": 0, "audio_seconds": 0.0, "busy_seconds": 0.0}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="stt-worker", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, audio):
+        """Queue float32 16 kHz ``audio``; returns a Future resolving to the transcript."""
+        job = _Job(audio, Future())
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self.stats["rejected"] += 1
+            raise STTQueueFull("Speech-to-text queue is full")
+        return job.future
+
+    def transcribe(self, audio):
+        """Blocking helper for callers on a plain thread."""
+        return self.submit(audio).result()
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def real_time_factor(self):
+        audio = self.stats["audio_seconds"]
+        return self.stats["busy_seconds"] / audio if audio else 0.0
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                backend = self.backend.get() if isinstance(self.backend, LazyResource) else self.backend
+            except Exception as e:
+                for job in batch:
+                    if job.future.set_running_or_notify_cancel():
+                        job.future.set_exception(e)
+                continue
+
+            short = [job for job in batch if len(job.audio) <= MAX_BATCH_SAMPLES]
+            if short:
+                self._process(short, backend.transcribe_batch)
+            for job in batch:
+                if len(job.audio) > MAX_BATCH_SAMPLES:
+                    self._process([job], lambda audios: [backend.transcribe(audios[0])])
+
+    def _process(self, jobs, transcribe):
+        jobs = [job for job in jobs if job.future.set_running_or_notify_cancel()]
+        if not jobs:
+            return
+        started = time.perf_counter()
+        try:
+            texts = transcribe([job.audio for job in jobs])
+        except Exception as e:
+            for job in jobs:
+                job.future.set_exception(e)
+            return
+        finally:
+            self.stats["busy_seconds"] += time.perf_counter() - started
+            self.stats["batches"] += 1
+            self.stats["clips"] += len(jobs)
+            self.stats["audio_seconds"] += sum(len(job.audio) for job in jobs) / SAMPLE_RATE
+        for job, text in zip(jobs, texts):
+            job.future.set_result(text)
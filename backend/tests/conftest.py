@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """app.py imported once, with its stores created in a temporary directory."""
+    pytest.importorskip("quart")
+    pytest.importorskip("sentence_transformers")
+    workdir = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(workdir)  # app creates its stores in the working directory
+        import app
+    return app
+
+
+@pytest.fixture
+def app(app_module, monkeypatch):
+    # Word counts stand in for the tokenizers so no model is loaded
+    monkeypatch.setattr(app_module, "count_embedding_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(app_module, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(app_module, "chunk_max_tokens", lambda: 256)
+    return app_module
@@ -0,0 +1,9 @@
+import context_builder
+
+
+def test_missing_tokenizer_file_falls_back_to_the_estimate(tmp_path, capsys):
+    # A local path must not be looked up on the hub
+    count = context_builder.load_token_counter(str(tmp_path / "tokenizer.json"))
+
+    assert count is context_builder.estimate_tokens
+    assert capsys.readouterr().out.count("Estimating token counts") == 1
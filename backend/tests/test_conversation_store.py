@@ -0,0 +1,24 @@
+import base64
+import json
+
+import conversation_store
+import image_store
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 16
+
+
+def test_json_import_moves_inline_images_to_the_image_store(tmp_path):
+    image_store.init_image_store(str(tmp_path / "images"))
+    legacy = tmp_path / "conversations.json"
+    legacy.write_text(json.dumps({"c1": {"title": "Photo", "messages": [
+        {"role": "user", "content": "What is this?", "image": "data:image/png;base64," + base64.b64encode(PNG).decode()},
+        {"role": "assistant", "content": "A sample."},
+    ]}}))
+
+    conversation_store.init_store(str(tmp_path / "conversations.db"), legacy_json=str(legacy),
+                                  save_image=image_store.save_image, decode_image=image_store.decode_data_url)
+
+    messages, _ = conversation_store.get_messages_page("c1")
+    assert "image" not in messages[0]
+    assert image_store.load_image(messages[0]["imageId"]) == PNG
+    assert not legacy.exists()
@@ -0,0 +1,52 @@
+import asyncio
+import uuid
+
+import conversation_store
+
+
+def edit(app, monkeypatch, history, message_index, new_content):
+    async def ollama_chat(payload, *args, **kwargs):
+        return {"message": {"content": f"Reply to: {payload['messages'][-1]['content']}"}}
+
+    monkeypatch.setattr(app, "ollama_chat", ollama_chat)
+    monkeypatch.setattr(app, "schedule_summary_update", lambda conversation_id: None)
+    conversation_id = str(uuid.uuid4())
+    conversation_store.create_conversation(conversation_id)
+    conversation_store.append_messages(conversation_id, history)
+
+    async def post():
+        client = app.app.test_client()
+        response = await client.post("/api/edit-message", json={
+            "conversationId": conversation_id, "messageIndex": message_index, "newContent": new_content,
+        })
+        return response.status_code, await response.get_json()
+
+    status, body = asyncio.run(post())
+    messages, _ = conversation_store.get_messages_page(conversation_id)
+    return status, body, messages
+
+
+def test_regenerated_reply_drops_old_sources(app, monkeypatch):
+    status, body, messages = edit(app, monkeypatch, [
+        {"role": "user", "content": "What is in VESG-2?"},
+        {"role": "assistant", "content": "The curing rules.", "sources": [{"path": "files/VESG-2.pdf", "page": 3}]},
+    ], 0, "Tell me a joke")
+
+    assert status == 200
+    assert messages == [
+        {"role": "user", "content": "Tell me a joke"},
+        {"role": "assistant", "content": "Reply to: Tell me a joke"},
+    ]
+    assert body["messages"] == messages
+
+
+def test_trailing_user_message_gets_a_reply(app, monkeypatch):
+    status, body, messages = edit(app, monkeypatch, [
+        {"role": "user", "content": "Hello"},
+        {"role": "assistant", "content": "Hi!"},
+        {"role": "user", "content": "What is in VESG-2?"},
+    ], 2, "What is in person.pdf?")
+
+    assert status == 200
+    assert body["content"] == "Reply to: What is in person.pdf?"
+    assert [m["content"] for m in messages] == ["Hello", "Hi!", "What is in person.pdf?", "Reply to: What is in person.pdf?"]
@@ -0,0 +1,54 @@
+import pytest
+
+import extractors
+
+TXT = "Scope\n\nThe inspection covers the spillway and the intake gates.\n"
+
+
+def test_extract_part_accepts_str_paths(tmp_path):
+    # scan_folder hands the pool plain strings, not Path objects
+    path = tmp_path / "data.txt"
+    path.write_text(TXT, encoding="utf-8")
+
+    assert extractors.plan_parts(str(path), 25) == [(None, None)]
+    blocks = extractors.extract_part(str(path))
+    assert "spillway" in extractors.blocks_to_text(blocks)
+
+
+def test_extract_part_raises_for_unreadable_files(tmp_path):
+    pytest.importorskip("PyPDF2")
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"%PDF-1.4 truncated")
+
+    with pytest.raises(Exception):
+        extractors.extract_part(str(path))
+
+
+def test_extract_files_indexes_txt(app, tmp_path):
+    path = tmp_path / "data.txt"
+    path.write_text(TXT, encoding="utf-8")
+    try:
+        results = list(app.extract_files([str(path)]))
+    finally:
+        if app.extract_pool is not None:
+            app.extract_pool.shutdown()
+            app.extract_pool = None
+
+    assert len(results) == 1
+    result_path, chunks = results[0]
+    assert result_path == str(path)
+    assert any("spillway" in chunk["text"] for chunk in chunks)
+
+
+def test_extract_files_reports_unreadable_files(app, tmp_path):
+    # A corrupt file must fail, not index as an empty document
+    path = tmp_path / "broken.pdf"
+    path.write_bytes(b"%PDF-1.4 truncated")
+    try:
+        results = list(app.extract_files([str(path)]))
+    finally:
+        if app.extract_pool is not None:
+            app.extract_pool.shutdown()
+            app.extract_pool = None
+
+    assert results == [(str(path), None)]
@@ -0,0 +1,70 @@
+import asyncio
+import uuid
+
+import numpy as np
+
+import conversation_store
+
+SOURCES = [{"path": "files/VESG-2.pdf", "page": 3, "section": "Clauses"}]
+
+
+def fake_retrieval(app, monkeypatch, replies):
+    """Route every question to the same retrieved chunk and answer from ``replies``."""
+    embedding = np.ones(app.EMBEDDING_DIMENSION, dtype=np.float32) / np.sqrt(app.EMBEDDING_DIMENSION)
+    hits = [{"path": SOURCES[0]["path"], "offset": 0, "score": 0.9}]
+
+    async def fetch_ai_reply(prompt, *args, **kwargs):
+        return next(replies)
+
+    monkeypatch.setattr(app, "embed_query", lambda query: embedding)
+    monkeypatch.setattr(app, "semantic_search_hits", lambda query, top_k=3: hits)
+    monkeypatch.setattr(app.query_router, "route", lambda query, score: (app.ROUTE_SEARCH, {}))
+    monkeypatch.setattr(app, "build_search_prompt", lambda question, query: (
+        [{"role": "user", "content": question}], SOURCES))
+    monkeypatch.setattr(app, "fetch_ai_reply", fetch_ai_reply)
+    monkeypatch.setattr(app, "schedule_summary_update", lambda conversation_id: None)
+    app.response_cache.clear()
+
+
+def new_conversation(history=()):
+    conversation_id = str(uuid.uuid4())
+    conversation_store.create_conversation(conversation_id)
+    if history:
+        conversation_store.append_messages(conversation_id, list(history))
+    return conversation_id
+
+
+def ask(app, conversation_id, question):
+    async def post():
+        client = app.app.test_client()
+        response = await client.post("/api/chat", json={
+            "conversationId": conversation_id,
+            "messages": [{"role": "user", "content": question}],
+        })
+        return (await response.get_json())["content"]
+    return asyncio.run(post())
+
+
+def test_same_follow_up_in_two_conversations_is_answered_for_each(app, monkeypatch):
+    fake_retrieval(app, monkeypatch, iter(["Clause 2 of VESG-2 sets the curing time.",
+                                           "The second sample failed the pH test."]))
+    first = new_conversation([
+        {"role": "user", "content": "List the clauses of VESG-2"},
+        {"role": "assistant", "content": "1. Scope 2. Curing time", "sources": SOURCES},
+    ])
+    second = new_conversation([
+        {"role": "user", "content": "Which samples were tested in VESG-2?"},
+        {"role": "assistant", "content": "Two samples, A and B.", "sources": SOURCES},
+    ])
+
+    assert ask(app, first, "and the second one?") == "Clause 2 of VESG-2 sets the curing time."
+    assert ask(app, second, "and the second one?") == "The second sample failed the pH test."
+    assert len(app.response_cache) == 0
+
+
+def test_first_question_is_shared_between_conversations(app, monkeypatch):
+    fake_retrieval(app, monkeypatch, iter(["VESG-2 covers concrete curing."]))
+
+    assert ask(app, new_conversation(), "What does VESG-2 cover?") == "VESG-2 covers concrete curing."
+    # No second reply is available: this one has to come from the cache
+    assert ask(app, new_conversation(), "What does VESG-2 cover?") == "VESG-2 covers concrete curing."
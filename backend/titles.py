@@ -0,0 +1,66 @@
+"""Conversation titles from keywords, without an LLM call.
+
+Candidate phrases are runs of up to ``MAX_PHRASE_WORDS`` content words in the
+first user message (stopwords and punctuation split them). Each candidate is
+embedded with the search embedding model and the one closest to the whole
+message becomes the title. Messages with nothing title-worthy ("hello",
+"thanks") return None and are left to the LLM.
+"""
+import re
+
+MAX_PHRASE_WORDS = 4
+MIN_SCORE = 0.35  # cosine similarity of the best phrase to the message; below this use the LLM
+MAX_CANDIDATES = 64
+
+_WORD_RE = re.compile(r"\w+(?:[-./']\w+)*")
+_BREAK_RE = re.compile(r"[,;:!?()\[\]\"\n]|\.(?:\s|$)")
+_STOPWORDS = frozenset("""
+a about after all also am an and any are as at be been being but by can could did do does for from get give
+had has have he her hi hello hey his how i if in into is it its just let me my need of on or our please she
+should so some tell thanks thank than that the their them then there these they this those to up us want was
+we were what when where which who why will with would you your
+au aux avec bonjour ce ces comment dans de des donne donner du elle en est et il ils je la le les leur mais
+me merci moi ne nous ou par pas peux pour pourquoi quel quelle quels quelles qu que qui quoi sa salut se ses
+selon sans sous son sont sur ta te tes toi ton tu un une vous
+""".split())
+
+
+def candidate_phrases(text):
+    """Runs of content words, plus their shorter sub-phrases, in order of first appearance."""
+    candidates = []
+    for part in _BREAK_RE.split(text):
+        run = []
+        for word in _WORD_RE.findall(part) + [None]:
+            if word is not None and word.lower() not in _STOPWORDS and not word.isdigit():
+                run.append(word)
+                continue
+            for size in range(min(len(run), MAX_PHRASE_WORDS), 0, -1):
+                for start in range(len(run) - size + 1):
+                    phrase = " ".join(run[start:start + size])
+                    if phrase.lower() not in (c.lower() for c in candidates):
+                        candidates.append(phrase)
+            run = []
+    return candidates[:MAX_CANDIDATES]
+
+
+def format_title(phrase):
+    # Keep codes and acronyms ("VESG-2", "pH") as written
+    return " ".join(w if any(c.isupper() for c in w) or any(c.isdigit() for c in w) else w.capitalize()
+                    for w in phrase.split())
+
+
+def keyword_title(text, encode, min_score=MIN_SCORE):
+    """Title for ``text`` from its best key phrase, or None if none is close enough.
+
+    ``encode(texts)`` returns L2-normalized embeddings, one row per text.
+    """
+    candidates = candidate_phrases(text)
+    if not candidates:
+        return None
+    embeddings = encode([text] + candidates)
+    scores = embeddings[1:] @ embeddings[0]
+    # Prefer longer phrases when they score nearly as well as a single word
+    best = max(range(len(candidates)), key=lambda i: scores[i] + 0.02 * len(candidates[i].split()))
+    if scores[best] < min_score:
+        return None
+    return format_title(candidates[best])
@@ -0,0 +1,383 @@
+"""Persistent vector index over document chunks.
+
+All chunk embeddings live in one contiguous, L2-normalized matrix so a query
+is a single matrix-vector product plus ``argpartition`` for a global top-k.
+The matrix is stored as float32, float16 or int8 (symmetric, one scale per
+row). When ``hnswlib`` is installed and the corpus is large, an HNSW graph is
+built on top of the matrix for approximate search.
+
+On disk each saved index is an immutable version directory under
+``<directory>/vectors/``: the ``.npy`` matrix, the chunk texts and metadata as
+JSON records in one file with an ``.npy`` array of their byte offsets, and a
+small ``files.json`` of the rows of each file. Loading maps these files
+read-only, so every worker process serving the same index shares one copy in
+the page cache. ``save`` writes a new version and then atomically replaces
+the ``CURRENT`` pointer; ``reload`` switches a reader to the latest version.
+"""
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+from threading import Lock
+
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # optional, only used for large corpora
+    hnswlib = None
+
+ANN_MIN_CHUNKS = 50000  # below this brute force is fast enough
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+SCORE_BLOCK_ROWS = 16384  # rows dequantized at a time when scoring float16/int8 storage
+STORAGE_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+VECTORS_DIR = "vectors"
+CURRENT_FILE = "CURRENT"  # name of the published version directory
+KEEP_VERSIONS = 3  # the current one plus older ones readers may still be loading
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+RECORDS_FILE = "records.jsonl"
+RECORD_OFFSETS_FILE = "record_offsets.npy"
+FILES_FILE = "files.json"
+HNSW_FILE = "hnsw.bin"
+
+# One immutable snapshot of the index; searches read it without locking
+_IndexState = namedtuple("_IndexState", ["embeddings", "scales", "records", "ann"])
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize(vectors, dtype):
+    """Return ``(stored, scales)`` for float32 ``vectors``; ``scales`` is None unless int8."""
+    if dtype == np.int8:
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        stored = np.round(vectors / scales[:, None]).astype(np.int8)
+        return stored, scales.astype(np.float32)
+    return vectors.astype(dtype), None
+
+
+def dequantize(stored, scales):
+    vectors = stored.astype(np.float32)
+    if scales is not None:
+        vectors *= scales[:, None]
+    return vectors
+
+
+def _file_rows(meta):
+    """``{path: [first_row, row_count]}``; the rows of a file are always contiguous."""
+    files = {}
+    for row, m in enumerate(meta):
+        files.setdefault(m["path"], [row, 0])[1] += 1
+    return files
+
+
+class _Records:
+    """Chunk texts and metadata held in lists, as built by ``VectorIndex.update``."""
+
+    def __init__(self, chunks, meta):
+        self.chunks = chunks
+        self.meta = meta
+        self.files = _file_rows(meta)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def get(self, row):
+        return self.chunks[row], self.meta[row]
+
+
+class _MappedRecords:
+    """Chunk texts and metadata as JSON records in a memory-mapped file, decoded on access."""
+
+    def __init__(self, data, offsets, files):
+        self.data = data
+        self.offsets = offsets
+        self.files = files
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, row):
+        record = json.loads(bytes(self.data[self.offsets[row]:self.offsets[row + 1]]))
+        return record.pop("chunk"), record
+
+
+def published_version(directory):
+    """Name of the version directory last published in ``directory``, or None."""
+    try:
+        with open(os.path.join(directory, VECTORS_DIR, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class VectorIndex:
+    """Chunk embeddings for every indexed file plus their path, offset, page and section metadata."""
+
+    def __init__(self, dim, dtype="float32"):
+        self.dim = dim
+        self.dtype = STORAGE_DTYPES[dtype]
+        self.version = 0
+        self.published = None  # version directory the current state was loaded from or saved to
+        self._lock = Lock()
+        self._rows = None  # (state, {path: {offset: row}}) filled in by lookups
+        self._state = _IndexState(*quantize(np.zeros((0, dim), dtype=np.float32), self.dtype), _Records([], []), None)
+
+    def nbytes(self):
+        state = self._state
+        return state.embeddings.nbytes + (state.scales.nbytes if state.scales is not None else 0)
+
+    def __len__(self):
+        return len(self._state.records)
+
+    def paths(self):
+        return set(self._state.records.files)
+
+    def chunks_for(self, path):
+        records = self._state.records
+        start, count = records.files.get(path, (0, 0))
+        return [records.get(row)[0] for row in range(start, start + count)]
+
+    def records_for(self, path):
+        """``(chunks, metas)`` of ``path``, with the metas as they were passed to ``update``."""
+        records = self._state.records
+        start, count = records.files.get(path, (0, 0))
+        rows = [records.get(row) for row in range(start, start + count)]
+        return [chunk for chunk, _ in rows], [{k: v for k, v in meta.items() if k != "path"} for _, meta in rows]
+
+    def update(self, files, removed=()):
+        """Replace the chunks of ``files`` and drop ``removed`` paths.
+
+        ``files`` maps path -> ``(chunks, metas, embeddings)``, where each meta
+        is a dict with at least ``offset`` (see ``StructuredChunker``). Rows of
+        other files are kept as they are; readers switch to the new snapshot at once.
+        """
+        with self._lock:
+            old = self._state
+            drop = set(files) | set(removed)
+            keep = [row for path, (start, count) in sorted(old.records.files.items(), key=lambda item: item[1])
+                    if path not in drop for row in range(start, start + count)]
+
+            blocks = [old.embeddings[keep]]
+            scale_blocks = [old.scales[keep]] if old.scales is not None else None
+            kept = [old.records.get(row) for row in keep]
+            chunks = [chunk for chunk, _ in kept]
+            meta = [m for _, m in kept]
+            for path, (file_chunks, metas, embeddings) in files.items():
+                if not file_chunks:
+                    continue
+                stored, scales = quantize(normalize(embeddings).reshape(len(file_chunks), self.dim), self.dtype)
+                blocks.append(stored)
+                if scale_blocks is not None:
+                    scale_blocks.append(scales)
+                chunks.extend(file_chunks)
+                meta.extend({"path": path, **m} for m in metas)
+
+            embeddings = np.ascontiguousarray(np.concatenate(blocks, axis=0))
+            scales = np.concatenate(scale_blocks) if scale_blocks is not None else None
+            self._state = _IndexState(embeddings, scales, _Records(chunks, meta), _build_ann(embeddings, scales))
+            self.version += 1
+
+    def search(self, query_embedding, top_k=3):
+        """Return the global ``top_k`` chunks as dicts with score, chunk, embedding and their metadata."""
+        state = self._state
+        n = len(state.records)
+        if n == 0:
+            return []
+        k = min(top_k, n)
+        query = normalize(query_embedding).reshape(-1)
+
+        if state.ann is not None:
+            labels, distances = state.ann.knn_query(query, k=k)
+            hits = [(1.0 - float(d), int(i)) for i, d in zip(labels[0], distances[0])]
+        else:
+            scores = _scores(state, query)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            hits = [(float(scores[i]), int(i)) for i in top]
+
+        rows = [i for _, i in hits]
+        vectors = dequantize(state.embeddings[rows], state.scales[rows] if state.scales is not None else None)
+        results = []
+        for (score, i), vector in zip(hits, vectors):
+            chunk, meta = state.records.get(i)
+            results.append({"score": score, "chunk": chunk, "embedding": vector, **meta})
+        return results
+
+    def lookup(self, keys, query_embedding):
+        """Return search-style hits for the ``(path, offset)`` keys that are indexed."""
+        state = self._state
+        rows = self._rows
+        if rows is None or rows[0] is not state:
+            rows = (state, {})
+            self._rows = rows
+        by_path = rows[1]
+        for path in {path for path, _ in keys}:
+            if path not in by_path:
+                start, count = state.records.files.get(path, (0, 0))
+                by_path[path] = {state.records.get(row)[1]["offset"]: row for row in range(start, start + count)}
+        found = [by_path[path][offset] for path, offset in keys if offset in by_path[path]]
+        if not found:
+            return []
+        vectors = dequantize(state.embeddings[found], state.scales[found] if state.scales is not None else None)
+        scores = vectors @ normalize(query_embedding).reshape(-1)
+        results = []
+        for i, vector, score in zip(found, vectors, scores):
+            chunk, meta = state.records.get(i)
+            results.append({"score": float(score), "chunk": chunk, "embedding": vector, **meta})
+        return results
+
+    # ========== PERSISTENCE ==========
+
+    def save(self, directory):
+        """Write the index as a new version directory and publish it.
+
+        Only one process (the indexer) should save to a directory. Afterwards
+        this index reads the saved, memory-mapped copy too.
+        """
+        state = self._state
+        vectors_dir = os.path.join(directory, VECTORS_DIR)
+        os.makedirs(vectors_dir, exist_ok=True)
+        name = str(time.time_ns())
+        tmp = os.path.join(vectors_dir, name + ".tmp")
+        os.makedirs(tmp)
+
+        np.save(os.path.join(tmp, EMBEDDINGS_FILE), np.asarray(state.embeddings))
+        if state.scales is not None:
+            np.save(os.path.join(tmp, SCALES_FILE), np.asarray(state.scales))
+        offsets = [0]
+        with open(os.path.join(tmp, RECORDS_FILE), "wb") as f:
+            for row in range(len(state.records)):
+                chunk, meta = state.records.get(row)
+                record = json.dumps({"chunk": chunk, **meta}, ensure_ascii=False).encode("utf-8")
+                f.write(record + b"\n")
+                offsets.append(offsets[-1] + len(record) + 1)
+        np.save(os.path.join(tmp, RECORD_OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+        with open(os.path.join(tmp, FILES_FILE), "w", encoding="utf-8") as f:
+            json.dump(state.records.files, f, ensure_ascii=False)
+        if state.ann is not None:
+            state.ann.save_index(os.path.join(tmp, HNSW_FILE))
+        os.rename(tmp, os.path.join(vectors_dir, name))
+
+        # Readers only ever see a complete version: the pointer is swapped last
+        current = os.path.join(vectors_dir, CURRENT_FILE)
+        with open(current + ".tmp", "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(current + ".tmp", current)
+        _remove_old_versions(directory, name)
+
+        mapped = _load_version(os.path.join(vectors_dir, name), self.dim, self.dtype, ann=state.ann)
+        with self._lock:
+            if self._state is state:  # not updated again meanwhile
+                self._state = mapped
+            self.published = name
+
+    def reload(self, directory):
+        """Switch to the version another process published in ``directory``; True if it changed."""
+        name = published_version(directory)
+        if name is None or name == self.published:
+            return False
+        try:
+            state = _load_version(os.path.join(directory, VECTORS_DIR, name), self.dim, self.dtype)
+        except Exception as e:
+            print(f"[Index] Could not load vector index version {name}: {e}")  # retried on the next check
+            return False
+        with self._lock:
+            self._state = state
+            self.published = name
+            self.version += 1
+        print(f"[Index] Switched to vector index version {name} ({len(state.records)} chunks)")
+        return True
+
+    @classmethod
+    def load(cls, directory, dim, dtype="float32"):
+        """Map the published index, or return an empty one if none exists or it is unusable.
+
+        An index saved with a different storage dtype is converted on load
+        (and then held in memory until the next save).
+        """
+        index = cls(dim, dtype)
+        name = published_version(directory)
+        if name is None:
+            return index
+        try:
+            state = _load_version(os.path.join(directory, VECTORS_DIR, name), dim, index.dtype)
+        except FileNotFoundError:
+            return index
+        except Exception as e:
+            print(f"[Index] Could not load vector index from {directory}: {e}")
+            return index
+        if state is None:
+            return index
+
+        index._state = state
+        index.published = name
+        print(f"[Index] Loaded {len(state.records)} chunk embeddings from {directory}")
+        return index
+
+
+def _load_version(path, dim, dtype, ann=None):
+    embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+    scales_path = os.path.join(path, SCALES_FILE)
+    scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+    offsets = np.load(os.path.join(path, RECORD_OFFSETS_FILE), mmap_mode="r")
+    with open(os.path.join(path, FILES_FILE), "r", encoding="utf-8") as f:
+        files = json.load(f)
+    data = np.memmap(os.path.join(path, RECORDS_FILE), dtype=np.uint8, mode="r") if offsets[-1] else b""
+    records = _MappedRecords(data, offsets, files)
+
+    if embeddings.shape != (len(records), dim) or (embeddings.dtype == np.int8 and scales is None):
+        print(f"[Index] Ignoring stale vector index in {path} (shape {embeddings.shape})")
+        return None
+    if embeddings.dtype != dtype:
+        embeddings, scales = quantize(dequantize(embeddings, scales), dtype)
+
+    hnsw_path = os.path.join(path, HNSW_FILE)
+    if ann is None and hnswlib is not None and os.path.exists(hnsw_path):
+        ann = hnswlib.Index(space="ip", dim=dim)
+        ann.load_index(hnsw_path, max_elements=len(embeddings))
+        ann.set_ef(HNSW_EF_SEARCH)
+    elif ann is None:
+        ann = _build_ann(embeddings, scales)
+    return _IndexState(embeddings, scales, records, ann)
+
+
+def _remove_old_versions(directory, current):
+    vectors_dir = os.path.join(directory, VECTORS_DIR)
+    versions = sorted(name for name in os.listdir(vectors_dir) if name.isdigit() and name != current)
+    stale = [name for name in os.listdir(vectors_dir) if name.endswith(".tmp") and name != CURRENT_FILE + ".tmp"]
+    for name in versions[:max(0, len(versions) - (KEEP_VERSIONS - 1))] + stale:
+        shutil.rmtree(os.path.join(vectors_dir, name), ignore_errors=True)  # may still be mapped on Windows
+
+
+def _scores(state, query):
+    if state.embeddings.dtype == np.float32:
+        return state.embeddings @ query
+    # Dequantize in blocks so a query never materializes the full float32 matrix
+    scores = np.empty(len(state.embeddings), dtype=np.float32)
+    for start in range(0, len(scores), SCORE_BLOCK_ROWS):
+        end = start + SCORE_BLOCK_ROWS
+        block = state.embeddings[start:end].astype(np.float32) @ query
+        if state.scales is not None:
+            block *= state.scales[start:end]
+        scores[start:end] = block
+    return scores
+
+
+def _build_ann(embeddings, scales=None):
+    if hnswlib is None or len(embeddings) < ANN_MIN_CHUNKS:
+        return None
+    ann = hnswlib.Index(space="ip", dim=embeddings.shape[1])
+    ann.init_index(max_elements=len(embeddings), ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+    ann.add_items(dequantize(embeddings, scales), np.arange(len(embeddings)))
+    ann.set_ef(HNSW_EF_SEARCH)
+    return ann
@@ -4,6 +4,79 @@ import { useState, useEffect, useRef } from "react"
 import axios from "axios"
 import "./App.css"
 
+// Reads the Server-Sent Events stream from /api/chat and reports the reply so far
+const streamChatReply = async (conversationId, messages, onToken) => {
+  const res = await fetch("http://127.0.0.1:5000/api/chat", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ conversationId, messages, stream: true }),
+  })
+
+  if (!res.ok || !res.body) {
+    const error = new Error(`Chat request failed with status ${res.status}`)
+    error.response = { status: res.status, data: await res.json().catch(() => ({})) }
+    throw error
+  }
+
+  const reader = res.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ""
+  let content = ""
+  let sources = []
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffer += decoder.decode(value, { stream: true })
+
+    const events = buffer.split("\n\n")
+    buffer = events.pop()
+    for (const event of events) {
+      if (!event.startsWith("data: ")) continue
+      const payload = JSON.parse(event.slice(6))
+      if (payload.token) {
+        content += payload.token
+        onToken(content)
+      } else if (payload.done) {
+        content = payload.content
+        sources = payload.sources || []
+      }
+    }
+  }
+
+  return { content, sources }
+}
+
+// "VESG-2.pdf, p. 3-4 (2.1 Scope)" for a retrieved passage
+const formatSource = (source) => {
+  let label = source.file
+  if (source.page) {
+    label += source.page_end && source.page_end !== source.page ? `, p. ${source.page}-${source.page_end}` : `, p. ${source.page}`
+  }
+  if (source.section) label += ` (${source.section})`
+  return label
+}
+
+// Downmixed microphone samples -> 16 kHz int16 PCM for the streaming STT socket
+const toPcm16 = (input, inputRate) => {
+  const ratio = inputRate / 16000
+  const length = Math.floor(input.length / ratio)
+  const output = new Int16Array(length)
+  for (let i = 0; i < length; i++) {
+    // Average each window instead of dropping samples, to limit aliasing
+    const start = Math.floor(i * ratio)
+    const end = Math.max(start + 1, Math.floor((i + 1) * ratio))
+    let sum = 0
+    for (let j = start; j < end; j++) sum += input[j]
+    const sample = Math.max(-1, Math.min(1, sum / (end - start)))
+    output[i] = sample * 0x7fff
+  }
+  return output.buffer
+}
+
+// Stored images are served by id; the server marks them cacheable forever
+const imageUrl = (msg) => msg.image || (msg.imageId && `http://127.0.0.1:5000/api/images/${msg.imageId}`)
+
 const WelcomeScreen = () => (
   <div className="welcome-screen">
     <div className="welcome-logo"></div>
@@ -39,6 +112,7 @@ const WelcomeScreen = () => (
 
 function App() {
   const [conversations, setConversations] = useState({})
+  const [nextCursor, setNextCursor] = useState(null) // Next page of the sidebar list
   const [currentConversation, setCurrentConversation] = useState(null)
   const [message, setMessage] = useState("")
   const [thinking, setThinking] = useState(false)
@@ -47,8 +121,7 @@ function App() {
   const [editedMessage, setEditedMessage] = useState("")
   const [selectedImage, setSelectedImage] = useState(null) // Voice Recording State
   const [isRecording, setIsRecording] = useState(false)
-  const mediaRecorderRef = useRef(null)
-  const audioChunksRef = useRef([])
+  const recorderRef = useRef(null)
   const textareaRef = useRef(null)
   const messageAreaRef = useRef(null)
 
@@ -59,6 +132,7 @@ function App() {
   useEffect(() => {
     if (currentConversation) {
       localStorage.setItem("currentConversation", currentConversation)
+      if (!conversations[currentConversation]?.loaded) loadMessages(currentConversation)
     }
   }, [currentConversation])
 
@@ -78,22 +152,26 @@ function App() {
     }
   }, [conversations, currentConversation, thinking])
 
-  const fetchConversations = () => {
+  // The list holds summaries only; messages are fetched per conversation when opened
+  const fetchConversations = (cursor = null) => {
     axios
-      .get("http://127.0.0.1:5000/api/conversations")
+      .get("http://127.0.0.1:5000/api/conversations", { params: cursor ? { cursor } : {} })
       .then((response) => {
-        const raw = response.data
         const parsed = {}
-        Object.entries(raw).forEach(([id, convo]) => {
-          parsed[id] = {
+        response.data.conversations.forEach((convo) => {
+          parsed[convo.id] = {
             title: convo.title || "New conversation",
-            messages: convo.messages || [],
+            messages: [],
+            messageStart: 0,
+            loaded: false,
           }
         })
-        setConversations(parsed)
+        setConversations((prev) => ({ ...prev, ...parsed }))
+        setNextCursor(response.data.nextCursor)
+        if (cursor) return
 
         const savedConversation = localStorage.getItem("currentConversation")
-        if (savedConversation && parsed[savedConversation]) {
+        if (savedConversation) {
           setCurrentConversation(savedConversation)
         } else if (Object.keys(parsed).length > 0 && !currentConversation) {
           setCurrentConversation(Object.keys(parsed)[0])
@@ -102,6 +180,55 @@ function App() {
       .catch((err) => console.error("Error fetching convos:", err))
   }
 
+  // Loads the latest page of messages, or the page before `before` when scrolling back
+  const loadMessages = (conversationId, before = null) => {
+    axios
+      .get(`http://127.0.0.1:5000/api/conversations/${conversationId}/messages`, {
+        params: before !== null ? { before } : {},
+      })
+      .then((response) => {
+        const page = response.data
+        setConversations((prev) => ({
+          ...prev,
+          [conversationId]: {
+            ...prev[conversationId],
+            title: page.title || "New conversation",
+            messages: before !== null ? [...page.messages, ...(prev[conversationId]?.messages || [])] : page.messages,
+            messageStart: page.start,
+            loaded: true,
+          },
+        }))
+      })
+      .catch((err) => {
+        if (err.response?.status === 404) {
+          localStorage.removeItem("currentConversation")
+          setCurrentConversation(null)
+        } else {
+          console.error("Error fetching messages:", err)
+        }
+      })
+  }
+
+  // Titles are generated in the background; poll until the server has one
+  const requestTitle = async (conversationId) => {
+    try {
+      const response = await axios.post("http://127.0.0.1:5000/api/update-title", { conversationId })
+      let title = response.data.title
+      for (let attempt = 0; !title && response.data.status === "title_queued" && attempt < 10; attempt++) {
+        await new Promise((resolve) => setTimeout(resolve, 2000))
+        const page = await axios.get(`http://127.0.0.1:5000/api/conversations/${conversationId}/messages`, {
+          params: { limit: 1 },
+        })
+        if (page.data.title !== "Untitled") title = page.data.title
+      }
+      if (title) {
+        setConversations((prev) => ({ ...prev, [conversationId]: { ...prev[conversationId], title } }))
+      }
+    } catch (err) {
+      console.error("Error updating title:", err)
+    }
+  }
+
   const handleImageUpload = async (e) => {
     const file = e.target.files[0]
     if (!file) return
@@ -127,11 +254,13 @@ function App() {
       .then((response) => {
         const newId = response.data.id
         setConversations((prev) => ({
-          ...prev,
           [newId]: {
             title: "New conversation",
             messages: [],
+            messageStart: 0,
+            loaded: true,
           },
+          ...prev,
         }))
         setCurrentConversation(newId)
         if (window.innerWidth < 768) setSidebarOpen(false)
@@ -214,17 +343,29 @@ function App() {
 
         console.log("Image API response data:", response.data)
       } else {
-        response = await axios.post("http://127.0.0.1:5000/api/chat", {
-          conversationId: currentConversation,
-          messages: updatedConvos[currentConversation].messages,
+        const sentMessages = [...updatedConvos[currentConversation].messages]
+        const reply = await streamChatReply(currentConversation, sentMessages, (partial) => {
+          setThinking(false)
+          setConversations((prev) => ({
+            ...prev,
+            [currentConversation]: {
+              ...prev[currentConversation],
+              messages: [...sentMessages, { role: "assistant", content: partial }],
+            },
+          }))
         })
+        response = { data: reply }
       }
 
       const newMessages = [...updatedConvos[currentConversation].messages]
+      if (response.data.imageId) {
+        newMessages[newMessages.length - 1] = { ...newMessages[newMessages.length - 1], imageId: response.data.imageId }
+      }
 
       newMessages.push({
         role: "assistant",
         content: response.data.content || "⚠️ Empty response from model.",
+        ...(response.data.sources?.length > 0 && { sources: response.data.sources }),
       })
 
       updatedConvos[currentConversation] = {
@@ -235,11 +376,9 @@ function App() {
       setConversations(updatedConvos)
       setThinking(false)
 
-      if (updatedConvos[currentConversation].messages.length >= 4) {
-        await axios.post("http://127.0.0.1:5000/api/update-title", {
-          conversationId: currentConversation,
-          messages: updatedConvos[currentConversation].messages,
-        })
+      if (updatedConvos[currentConversation].messages.length >= 4 &&
+          ["Untitled", "New conversation"].includes(updatedConvos[currentConversation].title)) {
+        requestTitle(currentConversation)
       }
     } catch (error) {
       console.error("Error sending message:", error)
@@ -309,6 +448,7 @@ function App() {
       role: "user",
       content: editedMessage,
       ...(originalMessage.image && { image: originalMessage.image }), // Preserve image if it exists
+      ...(originalMessage.imageId && { imageId: originalMessage.imageId }),
     }
 
     messages.splice(editingMessage + 1) // Remove below
@@ -324,9 +464,9 @@ function App() {
     try {
       const res = await axios.post("http://127.0.0.1:5000/api/edit-message", {
         conversationId: currentConversation,
-        messageIndex: editingMessage,
+        messageIndex: (conversations[currentConversation].messageStart || 0) + editingMessage,
         newContent: editedMessage,
-        hasImage: !!originalMessage.image, // Send flag to backend
+        hasImage: !!imageUrl(originalMessage), // Send flag to backend
       })
 
       if (res.data.error) {
@@ -352,51 +492,75 @@ function App() {
 
   const toggleRecording = async () => {
     if (isRecording) {
-      // Stop recording
-      if (mediaRecorderRef.current) {
-        mediaRecorderRef.current.stop()
+      // Stop recording; the server sends the final transcript and closes the socket
+      if (recorderRef.current) {
+        recorderRef.current.stop()
+        recorderRef.current = null
       }
       setIsRecording(false)
-    } else {
-      // Start recording
-      try {
-        const stream = await navigator.mediaDevices.getUserMedia({ audio: true })
-        const mediaRecorder = new MediaRecorder(stream)
-        mediaRecorderRef.current = mediaRecorder
-        audioChunksRef.current = []
-
-        mediaRecorder.ondataavailable = (e) => {
-          audioChunksRef.current.push(e.data)
-        }
+      return
+    }
 
-        mediaRecorder.onstop = async () => {
-          const blob = new Blob(audioChunksRef.current, { type: "audio/wav" })
-
-          const formData = new FormData()
-          formData.append("audio", blob, "voice.wav")
-
-          try {
-            const res = await axios.post("http://127.0.0.1:5000/api/stt", formData, {
-              headers: {
-                "Content-Type": "multipart/form-data",
-              },
-            })
-
-            if (res.data.text) {
-              setMessage((prev) => prev + " " + res.data.text.trim())
-            }
-          } catch (err) {
-            console.error("STT request failed:", err)
-            alert("❌ Error converting speech to text")
-          }
+    // Start recording and stream audio to the server while the user speaks
+    try {
+      const stream = await navigator.mediaDevices.getUserMedia({ audio: true })
+      const socket = new WebSocket("ws://127.0.0.1:5000/api/stt/stream")
+      const audioContext = new AudioContext()
+      const source = audioContext.createMediaStreamSource(stream)
+      const processor = audioContext.createScriptProcessor(4096, 1, 1)
+
+      const baseMessage = message
+      const segments = []
+      let partial = { segment: 0, text: "" }
+      const render = () => {
+        const pieces = [baseMessage, ...segments]
+        if (partial.segment === segments.length) pieces.push(partial.text)
+        setMessage(pieces.filter(Boolean).join(" ").trim())
+      }
+
+      socket.onmessage = (event) => {
+        const data = JSON.parse(event.data)
+        if (data.type === "partial" && data.segment === segments.length) {
+          partial = data
+        } else if (data.type === "segment") {
+          segments[data.segment] = data.text
+          partial = { segment: data.segment + 1, text: "" }
+        } else if (data.type === "final") {
+          socket.close()
+        } else if (data.type === "error") {
+          alert("❌ " + data.error)
         }
+        render()
+      }
 
-        mediaRecorder.start()
-        setIsRecording(true)
-      } catch (err) {
-        console.error("Microphone error:", err)
-        alert("⚠️ Could not access microphone.")
+      socket.onerror = (err) => {
+        console.error("STT stream failed:", err)
+        alert("❌ Error converting speech to text")
       }
+
+      processor.onaudioprocess = (e) => {
+        if (socket.readyState === WebSocket.OPEN) {
+          socket.send(toPcm16(e.inputBuffer.getChannelData(0), audioContext.sampleRate))
+        }
+      }
+      source.connect(processor)
+      processor.connect(audioContext.destination)
+
+      recorderRef.current = {
+        stop: () => {
+          processor.disconnect()
+          source.disconnect()
+          stream.getTracks().forEach((track) => track.stop())
+          audioContext.close()
+          if (socket.readyState === WebSocket.OPEN) {
+            socket.send(JSON.stringify({ type: "stop" }))
+          }
+        },
+      }
+      setIsRecording(true)
+    } catch (err) {
+      console.error("Microphone error:", err)
+      alert("⚠️ Could not access microphone.")
     }
   }
 
@@ -469,6 +633,11 @@ function App() {
                 </button>
               </div>
             ))}
+            {nextCursor && (
+              <button className="conversation-btn" onClick={() => fetchConversations(nextCursor)}>
+                Load more…
+              </button>
+            )}
           </div>
         </div>
         <button className="toggle-btn" onClick={() => setSidebarOpen(!sidebarOpen)}>
@@ -486,7 +655,16 @@ function App() {
             (currentConversation && conversations[currentConversation]?.messages?.length === 0) ? (
             <WelcomeScreen />
           ) : (
-            conversations[currentConversation].messages.map((msg, index) => (
+            <>
+            {conversations[currentConversation].messageStart > 0 && (
+              <button
+                className="conversation-btn"
+                onClick={() => loadMessages(currentConversation, conversations[currentConversation].messageStart)}
+              >
+                Load earlier messages
+              </button>
+            )}
+            {conversations[currentConversation].messages.map((msg, index) => (
               <div
                 key={index}
                 className={`message ${msg.role} animate${editingMessage === index ? " editing" : ""}`}
@@ -521,16 +699,19 @@ function App() {
                     <textarea autoFocus value={editedMessage} onChange={(e) => setEditedMessage(e.target.value)} />
                   ) : (
                     <>
-                      {msg.image && (
+                      {imageUrl(msg) && (
                         <div className="message-image">
                           <img
-                            src={msg.image || "/placeholder.svg"}
+                            src={imageUrl(msg) || "/placeholder.svg"}
                             alt="Uploaded image"
                             style={{ maxWidth: "300px", maxHeight: "300px", borderRadius: "8px" }}
                           />
                         </div>
                       )}
                       {msg.content && <div className="message-text">{formatMessageWithCodeBlocks(msg.content)}</div>}
+                      {msg.sources?.length > 0 && (
+                        <div className="message-sources">Sources: {msg.sources.map(formatSource).join(" · ")}</div>
+                      )}
                     </>
                   )}
                 </div>
@@ -553,7 +734,8 @@ function App() {
                   </div>
                 )}
               </div>
-            ))
+            ))}
+            </>
           )}
           {thinking && (
             <div className="thinking-indicator">